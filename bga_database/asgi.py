@@ -0,0 +1,247 @@
+"""
+ASGI config for bga_database project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with, e.g., ``uvicorn bga_database.asgi:application``.
+
+Django 2.2 has no ASGI handler, async views or async database access of its
+own, so the application adapts the WSGI handler: requests are read and
+written on the event loop, and handled in pools of threads. One process then
+serves as many requests at once as it has threads, and a slow query holds
+only its own thread, rather than a whole worker. The JSON endpoints behind
+the benefits table and charts get a pool of their own, so page loads, the
+admin and exports can't crowd them out. Exports, which hold a thread for as
+long as the download takes, get a small pool of their own, too.
+
+Request bodies are read into memory before they're handled, so they're
+limited to DATA_UPLOAD_MAX_MEMORY_SIZE, and to their Content-Length, if it's
+smaller.
+
+Each thread keeps its own database connection, so a process may hold as many
+connections as it has threads. See ASGI_THREADS, ASGI_JSON_THREADS and
+ASGI_EXPORT_THREADS.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import sys
+import threading
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bga_database.settings')
+
+# Views served from the JSON pool, by URL name.
+JSON_VIEWS = (
+    'benefit_list_json',
+    'benefit_stats_json',
+    'benefit_history_json',
+    'fund_summary_json',
+)
+
+# Views served from the export pool, by URL name.
+EXPORT_VIEWS = (
+    'benefit_export',
+)
+
+
+class ThreadPoolApplication:
+    '''
+    ASGI application that handles each HTTP request with a WSGI application,
+    in a thread from the pool for the request's path. Bodies longer than
+    max_body_size, or than their Content-Length, are refused.
+    '''
+    def __init__(self, wsgi_application, pools, default_pool, max_body_size=None):
+        self.wsgi_application = wsgi_application
+        self.pools = pools
+        self.default_pool = default_pool
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported connection type: {}'.format(scope['type']))
+
+        limit = self._body_limit(scope)
+
+        body = []
+        size = 0
+
+        while True:
+            message = await receive()
+
+            if message['type'] == 'http.disconnect':
+                return
+
+            chunk = message.get('body', b'')
+            size += len(chunk)
+
+            if limit is not None and size > limit:
+                await send({
+                    'type': 'http.response.start',
+                    'status': 413,
+                    'headers': [(b'content-type', b'text/plain')],
+                })
+                await send({'type': 'http.response.body', 'body': b'Request body too large'})
+                return
+
+            body.append(chunk)
+
+            if not message.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+
+        # Streamed responses, e.g., exports, stop when the client goes away.
+        disconnected = threading.Event()
+        watcher = loop.create_task(self._watch_disconnect(receive, disconnected))
+
+        try:
+            await loop.run_in_executor(
+                self.pools.get(scope['path'], self.default_pool),
+                self._handle, scope, b''.join(body), loop, send, disconnected
+            )
+
+        finally:
+            watcher.cancel()
+
+    def _handle(self, scope, body, loop, send, disconnected):
+        '''
+        Run the WSGI application, and send its response, from a worker
+        thread. The response is iterated and closed in the same thread, since
+        Django's database connections belong to the thread that opened them.
+        '''
+        def send_message(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        response = self.wsgi_application(self._environ(scope, body), start_response)
+
+        try:
+            send_message(dict(started, type='http.response.start'))
+
+            for chunk in response:
+                if disconnected.is_set():
+                    return
+
+                if chunk:
+                    send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+            send_message({'type': 'http.response.body', 'body': b''})
+
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+
+    def _body_limit(self, scope):
+        limit = self.max_body_size
+
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'content-length':
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    break
+
+                if limit is None or content_length < limit:
+                    limit = content_length
+
+                break
+
+        return limit
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            # WSGI paths are bytes decoded as Latin-1.
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+
+        for name, value in scope.get('headers', []):
+            name, value = name.decode('latin-1'), value.decode('latin-1')
+
+            if name == 'content-length':
+                key = 'CONTENT_LENGTH'
+            elif name == 'content-type':
+                key = 'CONTENT_TYPE'
+            else:
+                key = 'HTTP_{}'.format(name.upper().replace('-', '_'))
+
+            # Repeated headers are combined, as in WSGI.
+            if key in environ:
+                value = '{0},{1}'.format(environ[key], value)
+
+            environ[key] = value
+
+        return environ
+
+    async def _watch_disconnect(self, receive, disconnected):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                for pool in set(self.pools.values()) | {self.default_pool}:
+                    pool.shutdown(wait=False)
+
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def get_asgi_application():
+    wsgi_application = get_wsgi_application()
+
+    json_pool = ThreadPoolExecutor(settings.ASGI_JSON_THREADS, thread_name_prefix='json')
+    export_pool = ThreadPoolExecutor(settings.ASGI_EXPORT_THREADS, thread_name_prefix='export')
+    default_pool = ThreadPoolExecutor(settings.ASGI_THREADS, thread_name_prefix='default')
+
+    pools = {reverse(name): json_pool for name in JSON_VIEWS}
+    pools.update({reverse(name): export_pool for name in EXPORT_VIEWS})
+
+    return ThreadPoolApplication(
+        wsgi_application,
+        pools,
+        default_pool,
+        max_body_size=settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    )
+
+
+application = get_asgi_application()
@@ -0,0 +1,149 @@
+'''
+Send reads from the public, read-only views to a replica of the database,
+when one is configured as DATABASES['replica'], so imports and other writes
+to the primary don't slow them down.
+
+Only reads inside read_from_replica() go to the replica. Everything else,
+e.g., imports, the admin, sessions and the cache, reads from and writes to
+the primary, so it always sees its own writes.
+
+Cached values are stored under cache generations, which are bumped once writes
+to the primary commit, e.g., after an import. A request that reads from a
+replica that hasn't replayed those writes yet would cache old data under the
+new generations, until they expire. So, before bumping generations, the
+primary's WAL position is recorded in the cache, and reads stay on the primary
+until the replica has replayed up to it.
+'''
+from contextlib import contextmanager
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA_DB_ALIAS = 'replica'
+
+# Apps whose reads may go to the replica.
+REPLICA_APPS = ('pensions',)
+
+# The primary's WAL position when cache generations were last bumped. Keep it
+# out of TieredCache's in-process tier, so it's never older than the
+# generations read before it.
+PRIMARY_LSN_KEY = 'replica:primary_lsn'
+
+_state = threading.local()
+
+# The furthest WAL position the replica is known to have replayed, so it's
+# only asked again after another bump.
+_replayed_lsn = 0
+
+
+def _lsn(value):
+    # Convert a pg_lsn, e.g., '16/B374D848', to an integer.
+    high, low = value.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def _replay_lsn():
+    with connections[REPLICA_DB_ALIAS].cursor() as cursor:
+        cursor.execute('SELECT pg_last_wal_replay_lsn()')
+        lsn, = cursor.fetchone()
+
+    return lsn
+
+
+def record_primary_lsn():
+    '''
+    Record the primary's WAL position, before bumping cache generations after
+    a write commits.
+    '''
+    if REPLICA_DB_ALIAS not in settings.DATABASES:
+        return
+
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute('SELECT pg_current_wal_lsn()')
+        lsn, = cursor.fetchone()
+
+    cache.set(PRIMARY_LSN_KEY, lsn, None)
+
+
+def replica_is_current():
+    '''
+    Return whether the replica has replayed the primary's writes up to the
+    last bump of cache generations.
+    '''
+    global _replayed_lsn
+
+    lsn = cache.get(PRIMARY_LSN_KEY)
+
+    if lsn is None or _lsn(lsn) <= _replayed_lsn:
+        return True
+
+    replayed = _replay_lsn()
+
+    # The replica isn't in recovery, e.g., in tests, where it mirrors the
+    # primary.
+    if replayed is None:
+        return True
+
+    _replayed_lsn = max(_replayed_lsn, _lsn(replayed))
+
+    return _lsn(lsn) <= _replayed_lsn
+
+
+def check_replica():
+    '''
+    Inside read_from_replica(), stop reading from the replica if it's behind
+    the last bump of cache generations. Call it after reading generations.
+    '''
+    if getattr(_state, 'replica', False) and not replica_is_current():
+        _state.replica = False
+
+
+@contextmanager
+def read_from_replica():
+    '''
+    Send reads to the replica, if there is one, and it has replayed the
+    writes behind the current cache generations. Enter it after reading the
+    generations, e.g., in dispatch(), after CacheMixin has read them.
+    '''
+    previous = getattr(_state, 'replica', False)
+    _state.replica = REPLICA_DB_ALIAS in settings.DATABASES and replica_is_current()
+
+    try:
+        yield
+
+    finally:
+        _state.replica = previous
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if REPLICA_DB_ALIAS not in settings.DATABASES:
+            return None
+
+        if not getattr(_state, 'replica', False) or model._meta.app_label not in REPLICA_APPS:
+            return None
+
+        # Reads in a transaction on the primary may depend on its writes,
+        # which the replica won't have yet.
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is migrated through replication.
+        if db == REPLICA_DB_ALIAS:
+            return False
+
+        return None
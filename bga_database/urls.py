@@ -24,9 +24,14 @@ urlpatterns = [
     path('', pension_views.Index.as_view()),
     path('user-guide/', pension_views.UserGuide.as_view()),
     path('benefits/', pension_views.BenefitListJson.as_view(), name='benefit_list_json'),
+    path('history/', pension_views.BenefitHistoryJson.as_view(), name='benefit_history_json'),
+    path('export/', pension_views.BenefitExport.as_view(), name='benefit_export'),
+    path('summary/', pension_views.FundSummaryJson.as_view(), name='fund_summary_json'),
+    path('stats/', pension_views.BenefitStatsJson.as_view(), name='benefit_stats_json'),
     path('admin/', admin.site.urls),
     path('pong/', pension_views.pong),
     path('flush/', pension_views.flush_cache),
+    path('metrics/', pension_views.metrics_view),
     path('mailchimp/', include('mailchimp_auth.urls')),
     path('', include('django.contrib.auth.urls')),
 ]
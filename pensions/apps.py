@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PensionsConfig(AppConfig):
     name = 'pensions'
+
+    def ready(self):
+        import pensions.signals  # noqa: F401
@@ -0,0 +1,230 @@
+'''
+Time requests to the public views, as the benchmark commands do. Results are
+dictionaries of latency statistics, so they can be printed, or written out as
+JSON and compared across runs.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+import json
+import random
+import statistics
+import time
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from pensions.cache import bump_generation
+from pensions.models import BenefitSummary
+from pensions.views import BenefitListJson, Index
+
+
+# Parameters DataTables sends for each column of the benefits table.
+COLUMNS = {}
+
+for i, column in enumerate(BenefitListJson.columns):
+    COLUMNS.update({
+        'columns[{0}][data]'.format(i): i,
+        'columns[{0}][name]'.format(i): '',
+        'columns[{0}][searchable]'.format(i): 'true',
+        'columns[{0}][orderable]'.format(i): 'false' if column in ('first_name', 'status') else 'true',
+    })
+
+# Requests for pages of the benefits table to time, as parameters on top of
+# the fund, year and page length.
+SCENARIOS = (
+    ('first page', {}),
+    ('deep page', {'start_page': 20}),
+    ('order by name', {'order[0][column]': 1, 'order[0][dir]': 'asc'}),
+    ('search', {'search[value]': 'smi'}),
+    ('cursor', {'cursor': ''}),
+)
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def largest_summary(fund=None, data_year=None):
+    '''
+    Return the summary of the fund and year with the most benefits, optionally
+    limited to the given fund or year.
+    '''
+    summary = BenefitSummary.objects.select_related('fund').order_by('-count', '-data_year')
+
+    if data_year:
+        summary = summary.filter(data_year=data_year)
+
+    if fund:
+        summary = summary.filter(fund__name=fund)
+
+    summary = summary.first()
+
+    if not summary:
+        raise BenchmarkError('Found no benefits to request. Import some data, then try again.')
+
+    return summary
+
+
+def benefit_params(summary, length, scenario):
+    scenario = dict(scenario)
+
+    params = dict(COLUMNS, **{
+        'fund': summary.fund.name,
+        'data_year': summary.data_year,
+        'draw': 1,
+        'start': scenario.pop('start_page', 0) * length,
+        'length': length,
+        'order[0][column]': 2,
+        'order[0][dir]': 'desc',
+    })
+
+    params.update(scenario)
+
+    return params
+
+
+def time_benefits(params, n_requests):
+    '''
+    Time requests for a page of benefits, first without the cache, to time
+    the queries behind it, then from the cache.
+    '''
+    with override_settings(CACHES=NO_CACHE):
+        uncached = _time(lambda: _benefit_request(params), n_requests)
+
+    _time(lambda: _benefit_request(params), 1)
+    cached = _time(lambda: _benefit_request(params), n_requests)
+
+    return uncached, cached
+
+
+def time_index(n_requests):
+    '''
+    Time the home page with a cold cache, i.e., after invalidating every
+    cached value, then with a warm one. Template rendering is left out, since
+    it needs collected static files, and costs the same either way.
+    '''
+    cold = []
+
+    for _ in range(n_requests):
+        bump_generation()
+        cold.append(_time(_index_request, 1))
+
+    warm = _time(_index_request, n_requests)
+
+    # Combine the cold requests into one result.
+    timings = [timing for result in cold for timing in result['timings']]
+    cold = dict(describe(timings), queries=cold[-1]['queries'], timings=timings)
+
+    return cold, warm
+
+
+def benefit_pages(summary, length, n_requests):
+    '''
+    Return paths of n_requests pages of benefits from random offsets, so
+    they miss the cache, even across runs, and each queries the database.
+    '''
+    return [
+        '/benefits/?' + urlencode(dict(
+            benefit_params(summary, length, {}),
+            start=random.randrange(max(summary.count - length, 1))
+        ))
+        for _ in range(n_requests)
+    ]
+
+
+def load_test(base_url, paths, concurrency, headers=None):
+    '''
+    Request each path from a running server, concurrency requests at a time,
+    and time each request, and the whole run.
+    '''
+    def fetch(path):
+        start = time.perf_counter()
+
+        try:
+            with urlopen(Request(base_url.rstrip('/') + path, headers=headers or {})) as response:
+                response.read()
+
+        except URLError as e:
+            raise BenchmarkError('Request for {0} failed: {1}'.format(path, e))
+
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        timings = list(executor.map(fetch, paths))
+
+    seconds = time.perf_counter() - start
+
+    return dict(
+        describe(timings),
+        concurrency=concurrency,
+        requests_per_second=round(len(timings) / seconds, 1),
+        timings=timings
+    )
+
+
+def describe(timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+    return {
+        'requests': len(timings),
+        'median_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(p95, 2),
+        'max_ms': round(timings[-1], 2),
+    }
+
+
+def format_result(result):
+    return 'median {median_ms:.1f}ms, p95 {p95_ms:.1f}ms, max {max_ms:.1f}ms, {queries} queries'.format(**result)
+
+
+def _time(make_request, n_requests):
+    timings = []
+
+    for _ in range(n_requests):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            make_request()
+            timings.append((time.perf_counter() - start) * 1000)
+
+    return dict(describe(timings), queries=len(queries), timings=timings)
+
+
+def _request(path, params=None):
+    request = RequestFactory().get(path, params or {})
+
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+    request.user = AnonymousUser()
+    request._messages = FallbackStorage(request)
+
+    # Authenticate, so searches and page changes aren't throttled.
+    request.COOKIES[settings.MAILCHIMP_AUTH_COOKIE_NAME] = 'benchmark'
+
+    return request
+
+
+def _benefit_request(params):
+    response = BenefitListJson.as_view()(_request('/benefits/', params))
+
+    if response.status_code != 200:
+        raise BenchmarkError('Request failed: {}'.format(response.content))
+
+    json.loads(response.content)
+
+
+def _index_request():
+    response = Index.as_view()(_request('/'))
+
+    if response.status_code != 200:
+        raise BenchmarkError('Request failed with status {}'.format(response.status_code))
@@ -0,0 +1,92 @@
+'''
+Cached values are stored under the generations of the scopes they depend on,
+e.g., a data year or a fund's data in one year. A scope's generation is bumped
+whenever the data behind it change, e.g., on import or fixture load. Bumping a
+generation makes every value cached before it in that scope unreachable,
+without having to clear the cache or touch other scopes.
+
+Every value also depends on the global generation. Bump it to invalidate
+everything, e.g., when a fund is renamed.
+'''
+import time
+
+from django.core.cache import cache
+
+from bga_database.routers import record_primary_lsn
+
+
+GENERATION_KEY = 'generation'
+
+
+def _initial_generation():
+    # If the generation is evicted or the cache is cleared, start again from
+    # a value greater than any generation used before, rather than from 1.
+    return int(time.time() * 1000)
+
+
+def generation_key(scope=None):
+    if scope is None:
+        return GENERATION_KEY
+
+    return '{0}:{1}'.format(GENERATION_KEY, scope)
+
+
+def year_scope(data_year):
+    return 'year:{}'.format(int(data_year))
+
+
+def fund_scope(fund_id, data_year):
+    return 'fund:{0}:{1}'.format(int(fund_id), int(data_year))
+
+
+# Values that depend on every year, e.g., the list of years, are stored in the
+# index scope, which is bumped along with any year or fund.
+INDEX_SCOPE = 'index'
+
+
+def get_generations(scopes):
+    '''
+    Return a dictionary of the current generation of each scope, including
+    the global scope, None, in one round trip to the cache.
+    '''
+    scopes = [None] + [scope for scope in scopes if scope is not None]
+    keys = {generation_key(scope): scope for scope in scopes}
+
+    generations = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+
+    for key, scope in keys.items():
+        if scope not in generations:
+            cache.add(key, _initial_generation(), None)
+            generations[scope] = cache.get(key, _initial_generation())
+
+    return generations
+
+
+def get_generation(scope=None):
+    return get_generations([scope])[scope]
+
+
+def bump_generation(*scopes):
+    '''
+    Bump the generation of each given scope, or the global generation, if no
+    scope is given.
+    '''
+    # Before any new generation is visible, so no request can read it and
+    # then cache values read from a replica that's behind.
+    record_primary_lsn()
+
+    for scope in scopes or [None]:
+        key = generation_key(scope)
+
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_generation(), None)
+
+
+def bump_year(data_year):
+    bump_generation(INDEX_SCOPE, year_scope(data_year))
+
+
+def bump_funds(fund_ids, data_year):
+    bump_generation(INDEX_SCOPE, *[fund_scope(fund_id, data_year) for fund_id in fund_ids])
@@ -0,0 +1,205 @@
+'''
+A two-tier cache backend: a small in-process LRU cache in front of a shared
+cache, e.g., the database cache.
+
+Values that CacheMixin stores are versioned by cache generation, so a key's
+value never changes once it is set, and is safe to keep in process for as
+long as there's room. The generation keys themselves do change. They are kept
+in process briefly, so a bumped generation is seen by every worker within a
+few seconds. Keys that must always be read from the shared cache, e.g., locks,
+are never kept in process.
+
+Configure it with the alias of the shared cache as its location:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'pensions.cache_backends.TieredCache',
+            'LOCATION': 'shared',
+            'OPTIONS': {
+                'LOCAL_MAX_ENTRIES': 1000,
+                'LOCAL_TIMEOUT': 300,
+                'LOCAL_TIMEOUTS': {'generation': 5, 'lock:': 0},
+            },
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'pensions_cache',
+        },
+    }
+
+LOCAL_TIMEOUTS maps key prefixes to how long matching keys are kept in
+process, in seconds. Zero means never.
+
+Django creates cache backends for each thread, but values kept in process are
+stored at module level, like LocMemCache's, so every thread in a process, e.g.,
+in each of the ASGI server's pools, shares one LRU cache of LOCAL_MAX_ENTRIES.
+They're shared by every request, rather than unpickled for each one, so don't
+mutate values read from the cache.
+'''
+from collections import OrderedDict
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+MISSING = object()
+
+# Values kept in process, and the locks that guard them, by the alias of the
+# shared cache.
+_local_caches = {}
+_local_locks = {}
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+
+        options = params.get('OPTIONS', {})
+
+        self._shared_alias = location
+        self._local_max_entries = int(options.get('LOCAL_MAX_ENTRIES', 1000))
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 300)
+        self._local_timeouts = options.get('LOCAL_TIMEOUTS', {})
+
+        self._local = _local_caches.setdefault(location, OrderedDict())
+        self._lock = _local_locks.setdefault(location, threading.Lock())
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version)
+
+        found, value = self._get_local(local_key)
+
+        if found:
+            return value
+
+        value = self.shared.get(key, MISSING, version=version)
+
+        if value is MISSING:
+            return default
+
+        self._set_local(key, local_key, value)
+
+        return value
+
+    def get_many(self, keys, version=None):
+        values = {}
+        misses = []
+
+        for key in keys:
+            found, value = self._get_local(self.make_key(key, version))
+
+            if found:
+                values[key] = value
+            else:
+                misses.append(key)
+
+        if misses:
+            for key, value in self.shared.get_many(misses, version=version).items():
+                self._set_local(key, self.make_key(key, version), value)
+                values[key] = value
+
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self._set_local(key, self.make_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed_keys = self.shared.set_many(data, timeout, version=version)
+
+        for key, value in data.items():
+            if key not in failed_keys:
+                self._set_local(key, self.make_key(key, version), value, timeout)
+
+        return failed_keys
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+
+        if added:
+            self._set_local(key, self.make_key(key, version), value, timeout)
+
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        self._set_local(key, self.make_key(key, version), value)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def has_key(self, key, version=None):
+        found, _ = self._get_local(self.make_key(key, version))
+        return found or self.get(key, MISSING, version=version) is not MISSING
+
+    def delete(self, key, version=None):
+        self._delete_local(self.make_key(key, version))
+        self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._delete_local(self.make_key(key, version))
+
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def _local_timeout_for(self, key):
+        for prefix, timeout in self._local_timeouts.items():
+            if key.startswith(prefix):
+                return timeout
+
+        return self._local_timeout
+
+    def _get_local(self, local_key):
+        with self._lock:
+            try:
+                value, expires = self._local[local_key]
+            except KeyError:
+                return False, None
+
+            if expires <= time.monotonic():
+                del self._local[local_key]
+                return False, None
+
+            self._local.move_to_end(local_key)
+
+            return True, value
+
+    def _set_local(self, key, local_key, value, timeout=DEFAULT_TIMEOUT):
+        local_timeout = self._local_timeout_for(key)
+
+        timeout = self.get_backend_timeout(timeout)
+
+        if timeout is not None:
+            local_timeout = min(local_timeout, timeout - time.time())
+
+        if local_timeout <= 0:
+            self._delete_local(local_key)
+            return
+
+        with self._lock:
+            self._local[local_key] = (value, time.monotonic() + local_timeout)
+            self._local.move_to_end(local_key)
+
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _delete_local(self, local_key):
+        with self._lock:
+            self._local.pop(local_key, None)
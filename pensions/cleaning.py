@@ -0,0 +1,163 @@
+'''
+Clean raw benefit exports into the format expected by import_data, in a single
+streaming pass. Raw exports come in two shapes: one file per year from 2018 on,
+and one file covering 2012 through 2017, which lacks final salary and status.
+'''
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+
+
+FIELDNAMES = (
+    'first_name',
+    'last_name',
+    'amount',
+    'years_of_service',
+    'data_year',
+    'fund',
+    'start_date',
+    'final_salary',
+    'status',
+)
+
+# Columns of the raw exports that hold each field, in order of preference.
+# Fields are also read from columns that already have their clean name, so
+# cleaning a finished file changes nothing.
+RAW_COLUMNS = {
+    'first_name': ('FirstName',),
+    'last_name': ('LastName',),
+    'amount': ('PensionAmount',),
+    'years_of_service': ('YearsServed',),
+    'data_year': ('DataYear',),
+    'fund': ('Agency',),
+    'start_date': ('BenefitStart', 'BenefitStartDateOriginal'),
+    'final_salary': ('SalaryatRetirement',),
+    'status': ('Status',),
+}
+
+# Fields that weren't requested prior to 2018, and are left empty when they
+# are missing from an export.
+OPTIONAL_FIELDS = ('years_of_service', 'start_date', 'final_salary', 'status')
+
+DATE_FORMATS = ('%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d')
+
+
+class BenefitCleaner:
+    '''
+    Clean rows of a raw export for the given data year. Rows from other years,
+    and rows without an amount, are dropped. Counts of kept and dropped rows
+    are collected in stats.
+    '''
+
+    batch_size = 10000
+
+    def __init__(self, data_year):
+        self.data_year = str(data_year)
+        self.stats = Counter()
+        self.invalid_dates = Counter()
+
+        # Raw exports repeat the same few thousand start dates millions of
+        # times, so parse each distinct value only once.
+        self.dates = {'': ''}
+
+    def clean(self, reader):
+        '''
+        Yield clean rows, as dictionaries, from a csv.reader over a raw
+        export.
+        '''
+        header = next(reader, [])
+        columns = self._resolve_columns(header)
+
+        while True:
+            batch = list(islice(reader, self.batch_size))
+
+            if not batch:
+                break
+
+            rows = [row for row in (self._clean_row(row, columns, len(header)) for row in batch) if row]
+
+            self._parse_dates({row['start_date'] for row in rows})
+
+            for row in rows:
+                start_date = self.dates[row['start_date']]
+
+                if row['start_date'] and not start_date:
+                    self.invalid_dates[row['start_date']] += 1
+
+                row['start_date'] = start_date
+                yield row
+
+    def report(self):
+        lines = [
+            'read {0} rows'.format(self.stats['read']),
+            'kept {0} rows from {1}'.format(self.stats['kept'], self.data_year),
+            'skipped {0} rows from other years'.format(self.stats['other_year']),
+            'rejected {0} rows without an amount'.format(self.stats['no_amount']),
+            'omitted {0} invalid start dates'.format(sum(self.invalid_dates.values())),
+        ]
+
+        for value, count in self.invalid_dates.most_common(10):
+            lines.append('  {0!r} ({1} rows)'.format(value, count))
+
+        return '\n'.join(lines)
+
+    def _resolve_columns(self, header):
+        '''
+        Return the position of the column holding each field in the header.
+        Missing fields point just past the last column.
+        '''
+        header = [name.strip() for name in header]
+        columns = []
+
+        for field in FIELDNAMES:
+            candidates = (field,) + RAW_COLUMNS[field]
+            column = next((header.index(name) for name in candidates if name in header), None)
+
+            if column is None and field not in OPTIONAL_FIELDS:
+                message = 'Could not find a column for {0}. Columns are: {1}'.format(field, ', '.join(header))
+                raise ValueError(message)
+
+            columns.append(len(header) if column is None else column)
+
+        return columns
+
+    def _clean_row(self, row, columns, width):
+        self.stats['read'] += 1
+
+        # Pad or trim malformed rows to the width of the header, then add an
+        # empty value for missing fields to point at.
+        if len(row) != width:
+            row = (row + [''] * width)[:width]
+
+        row.append('')
+
+        clean_row = dict(zip(FIELDNAMES, [row[column].strip() for column in columns]))
+
+        if clean_row['data_year'] != self.data_year:
+            self.stats['other_year'] += 1
+            return None
+
+        if not clean_row['amount']:
+            self.stats['no_amount'] += 1
+            return None
+
+        self.stats['kept'] += 1
+
+        return clean_row
+
+    def _parse_dates(self, values):
+        for value in values:
+            if value in self.dates:
+                continue
+
+            self.dates[value] = ''
+
+            for fmt in DATE_FORMATS:
+                try:
+                    self.dates[value] = datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+
+                except ValueError:
+                    continue
+
+                else:
+                    break
@@ -0,0 +1,245 @@
+'''
+Bulk exports of benefits as CSV, streamed from Postgres with COPY ... TO
+STDOUT, so an export costs one query, and memory doesn't grow with its size.
+
+psycopg2 copies into a file-like object, and only returns when the copy is
+done, so the copy runs in a thread that hands chunks of CSV to the response
+through a bounded queue. When the client is slower than the database, the
+thread waits for it. When the client goes away, the query is cancelled.
+
+Exports of a whole fund and year are also written to EXPORT_DIR, gzipped,
+under the cache generations of the year and fund, so they're generated once
+per import, and served from disk after that.
+'''
+import glob
+import gzip
+import os
+import queue
+import threading
+import uuid
+import zlib
+
+from django.conf import settings
+from django.db import connections
+
+from pensions.cache import fund_scope, get_generations, year_scope
+
+
+EXPORT_FIELDS = (
+    'first_name',
+    'last_name',
+    'amount',
+    'years_of_service',
+    'final_salary',
+    'start_date',
+    'status',
+)
+
+# Rows are handed over in chunks of about this many bytes, and at most
+# QUEUE_SIZE chunks wait for the client at once.
+CHUNK_SIZE = 64 * 1024
+QUEUE_SIZE = 16
+
+# Have zlib write a gzip header and trailer.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Marks the end of the copy in the queue.
+_DONE = object()
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    '''
+    File-like object that psycopg2 copies into, which puts chunks of its
+    input on a queue.
+    '''
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        if self.cancelled.is_set():
+            raise ExportCancelled
+
+        self.buffer.append(data)
+        self.size += len(data)
+
+        if self.size >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.chunks.put(b''.join(self.buffer))
+            self.buffer, self.size = [], 0
+
+
+def copy_csv(queryset, using):
+    '''
+    Yield the EXPORT_FIELDS of the queryset as chunks of CSV, with a header,
+    copied from the given database.
+    '''
+    connection = connections[using]
+
+    # Open the connection here, rather than in the copy thread, so Django
+    # manages it as it does any other.
+    cursor = connection.cursor()
+
+    sql, params = queryset.values_list(*EXPORT_FIELDS).query.sql_with_params()
+
+    # COPY doesn't take parameters, so bind them first.
+    sql = 'COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)'.format(cursor.cursor.mogrify(sql, params).decode())
+
+    chunks = queue.Queue(QUEUE_SIZE)
+    cancelled = threading.Event()
+
+    def copy():
+        writer = _QueueWriter(chunks, cancelled)
+
+        try:
+            cursor.cursor.copy_expert(sql, writer)
+            writer.flush()
+            chunks.put(_DONE)
+
+        except Exception as e:
+            chunks.put(e)
+
+    thread = threading.Thread(target=copy, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            chunk = chunks.get()
+
+            if chunk is _DONE:
+                break
+
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            yield chunk
+
+    finally:
+        if thread.is_alive():
+            cancelled.set()
+            connection.connection.cancel()
+
+            # Unblock the thread, if it's waiting for room in the queue.
+            while thread.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        cursor.close()
+
+
+def gzip_chunks(chunks):
+    '''
+    Compress an iterable of bytes into a gzip stream, chunk by chunk.
+    '''
+    compressor = zlib.compressobj(wbits=GZIP_WBITS)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+def read_chunks(f):
+    '''
+    Read a file in chunks of CHUNK_SIZE.
+    '''
+    with f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            yield chunk
+
+
+class ExportFile:
+    '''
+    A whole fund's benefits in one year, exported to EXPORT_DIR as gzipped
+    CSV. Files are named for the generations of the fund and year, so a new
+    file is exported after each import, and older ones are removed.
+    '''
+    def __init__(self, fund_id, data_year):
+        self.fund_id = fund_id
+        self.data_year = data_year
+
+        scopes = (year_scope(data_year), fund_scope(fund_id, data_year))
+        generations = get_generations(scopes)
+        version = '.'.join(str(generations[scope]) for scope in (None,) + scopes)
+
+        self.path = os.path.join(self.directory, '{0}.{1}.csv.gz'.format(self.prefix, version))
+
+    @property
+    def directory(self):
+        return settings.EXPORT_DIR
+
+    @property
+    def prefix(self):
+        return 'benefits_{0}_{1}'.format(self.fund_id, self.data_year)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def open(self, gzipped=True):
+        '''
+        Return an iterable of chunks of the file, gzipped or not.
+        '''
+        if gzipped:
+            return read_chunks(open(self.path, 'rb'))
+
+        return read_chunks(gzip.open(self.path, 'rb'))
+
+    def write(self, chunks, gzipped=True):
+        '''
+        Write chunks of CSV to the file, while passing them on, gzipped or
+        not. The file appears once the last chunk is written.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Write to a temporary name, so concurrent exports of the same file
+        # don't read each other's partial output.
+        temp_path = '{0}.{1}.tmp'.format(self.path, uuid.uuid4().hex)
+
+        compressor = zlib.compressobj(wbits=GZIP_WBITS)
+
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    compressed = compressor.compress(chunk)
+                    f.write(compressed)
+
+                    if not gzipped:
+                        yield chunk
+                    elif compressed:
+                        yield compressed
+
+                compressed = compressor.flush()
+                f.write(compressed)
+
+                if gzipped:
+                    yield compressed
+
+            os.replace(temp_path, self.path)
+
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self._remove_stale()
+
+    def _remove_stale(self):
+        for path in glob.glob(os.path.join(self.directory, '{}.*.csv.gz'.format(self.prefix))):
+            if path != self.path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
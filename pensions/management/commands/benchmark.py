@@ -0,0 +1,120 @@
+from datetime import datetime
+import glob
+import json
+import os
+import re
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from pensions.benchmarks import (
+    SCENARIOS, BenchmarkError, benefit_params, format_result, largest_summary, time_benefits, time_index
+)
+from pensions.models import Benefit
+from pensions.views import BenefitListJson
+
+
+class Command(BaseCommand):
+    help = (
+        'Times imports, the home page with a cold and a warm cache, and pages of the '
+        'benefits table, and writes the results as JSON, so runs can be compared. '
+        'Invalidates every cached value, so run it against a local database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--import-dir',
+                            help='Directory of benefits_<data year>.csv files, as written by '
+                                 'generate_benefits, to import before timing requests. '
+                                 'Replaces existing data for each year.')
+
+        parser.add_argument('--workers',
+                            type=int,
+                            default=4,
+                            help='Number of processes to import with')
+
+        parser.add_argument('--requests',
+                            type=int,
+                            default=20,
+                            help='Number of times to make each request')
+
+        parser.add_argument('--length',
+                            type=int,
+                            default=BenefitListJson.max_display_length,
+                            help='Rows per page of benefits')
+
+        parser.add_argument('--output',
+                            help='File to write results to, as JSON')
+
+    def handle(self, *args, **options):
+        results = []
+
+        if options['import_dir']:
+            results.append(self._benchmark_import(options['import_dir'], options['workers']))
+
+        index_cold, index_warm = time_index(options['requests'])
+
+        results.append(dict(index_cold, name='index', cache='cold'))
+        results.append(dict(index_warm, name='index', cache='warm'))
+
+        try:
+            summary = largest_summary()
+
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+
+        for name, scenario in SCENARIOS:
+            params = benefit_params(summary, options['length'], scenario)
+
+            uncached, cached = time_benefits(params, options['requests'])
+
+            results.append(dict(uncached, name='benefits', scenario=name, cache='none'))
+            results.append(dict(cached, name='benefits', scenario=name, cache='warm'))
+
+        for result in results:
+            label = ' '.join(str(result[key]) for key in ('name', 'scenario', 'cache') if key in result)
+
+            if 'seconds' in result:
+                self.stdout.write('{0:<32}{1:.1f}s'.format(label, result['seconds']))
+            else:
+                self.stdout.write('{0:<32}{1}'.format(label, format_result(result)))
+
+        if options['output']:
+            report = {
+                'time': datetime.now().isoformat(),
+                'database': {
+                    'vendor': connection.vendor,
+                    'server_version': connection.pg_version,
+                    'benefits': Benefit.objects.count(),
+                    'benefits_timed': summary.count,
+                },
+                'options': {key: options[key] for key in ('workers', 'requests', 'length')},
+                'results': results,
+            }
+
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+            self.stdout.write('wrote results to {}'.format(options['output']))
+
+    def _benchmark_import(self, import_dir, workers):
+        data = []
+
+        for filepath in sorted(glob.glob(os.path.join(import_dir, 'benefits_*.csv'))):
+            data_year = re.search(r'benefits_(\d+)\.csv$', filepath).group(1)
+            data.extend([os.path.abspath(filepath), data_year])
+
+        if not data:
+            raise CommandError('Found no benefits_<data year>.csv files in {}'.format(import_dir))
+
+        start = time.perf_counter()
+
+        call_command('import_data', *data, workers=workers, warm_cache='False', stdout=self.stdout)
+
+        return {
+            'name': 'import',
+            'years': data[1::2],
+            'workers': workers,
+            'seconds': round(time.perf_counter() - start, 2),
+        }
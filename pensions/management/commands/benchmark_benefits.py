@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pensions.benchmarks import (
+    SCENARIOS, BenchmarkError, benefit_params, format_result, largest_summary, time_benefits
+)
+from pensions.views import BenefitListJson
+
+
+class Command(BaseCommand):
+    help = 'Times requests for pages of the benefits table, with and without the page cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fund',
+                            help='Name of the fund to request. Defaults to the fund with the most benefits in any year')
+
+        parser.add_argument('--data-year',
+                            type=int,
+                            help='Data year to request. Defaults to the year with the most benefits for the fund')
+
+        parser.add_argument('--length',
+                            type=int,
+                            default=BenefitListJson.max_display_length,
+                            help='Rows per page')
+
+        parser.add_argument('--requests',
+                            type=int,
+                            default=20,
+                            help='Number of times to request each page')
+
+    def handle(self, *args, **options):
+        try:
+            summary = largest_summary(options['fund'], options['data_year'])
+
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('Requesting {0} rows of {1} benefits for {2} in {3}'.format(
+            options['length'], summary.count, summary.fund.name, summary.data_year
+        ))
+
+        for name, scenario in SCENARIOS:
+            params = benefit_params(summary, options['length'], scenario)
+
+            uncached, cached = time_benefits(params, options['requests'])
+
+            for label, result in (('uncached', uncached), ('cached', cached)):
+                self.stdout.write('{0:<16}{1:<10}{2}'.format(name, label, format_result(result)))
@@ -0,0 +1,37 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pensions.cleaning import FIELDNAMES, BenefitCleaner
+
+
+class Command(BaseCommand):
+    help = 'Cleans a raw export of individual benefits into a file import_data can load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('raw_file',
+                            help='Absolute path to raw data export to clean')
+
+        parser.add_argument('data_year',
+                            help='Data year to keep from the raw data export')
+
+        parser.add_argument('output_file',
+                            help='Absolute path to write clean data to')
+
+    def handle(self, *args, **options):
+        cleaner = BenefitCleaner(options['data_year'])
+
+        with open(options['raw_file'], 'r', newline='') as raw, \
+                open(options['output_file'], 'w', newline='') as out:
+
+            writer = csv.writer(out)
+            writer.writerow(FIELDNAMES)
+
+            try:
+                # Clean rows are ordered by FIELDNAMES.
+                writer.writerows(row.values() for row in cleaner.clean(csv.reader(raw)))
+
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        self.stdout.write(cleaner.report())
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from pensions.exports import ExportFile, copy_csv
+from pensions.models import Benefit, BenefitSummary
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports every fund\'s benefits in the given data years, or every year, to '
+        'EXPORT_DIR, so the first download of each is served from disk'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('data_years',
+                            nargs='*',
+                            type=int,
+                            help='Data years to export. Defaults to every year.')
+
+    def handle(self, *args, **options):
+        summaries = BenefitSummary.objects.order_by('data_year', 'fund__name')
+
+        if options['data_years']:
+            summaries = summaries.filter(data_year__in=options['data_years'])
+
+        for fund_id, data_year in summaries.values_list('fund_id', 'data_year'):
+            export = ExportFile(fund_id, data_year)
+
+            if export.exists():
+                continue
+
+            benefits = Benefit.objects.filter(fund_id=fund_id, data_year=data_year).order_by('-amount', '-id')
+
+            for _ in export.write(copy_csv(benefits, 'default')):
+                pass
+
+            self.stdout.write('exported {}'.format(export.path))
@@ -0,0 +1,226 @@
+import csv
+from datetime import date, timedelta
+import json
+import math
+import os
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pensions.cleaning import FIELDNAMES
+
+
+DATA_YEARS = range(2012, 2022)
+
+# Approximate number of beneficiaries of each fund, relative to the others.
+# Funds missing from this list get the smallest share.
+FUND_SIZES = {
+    'Downstate/Suburban Municipal (IMRF)': 130,
+    'Downstate/Suburban Teachers (TRS)': 125,
+    'State Employees (SRS)': 80,
+    'State Universities (SURS)': 70,
+    'Chicago Teachers': 28,
+    'Chicago Municipal Employees (MEABF)': 26,
+    'Cook County Employees': 17,
+    'Chicago Police': 14,
+    'Chicago Transit': 10,
+    'Metra, Pace, RTA': 6,
+    'Chicago Firefighters': 5,
+    'Chicago Laborers': 3,
+    'Chicago Parks': 3,
+    'Sanitary District': 2,
+    'Judges/Legislators': 1,
+    'Chicago Housing Authority': 1,
+}
+
+# Median annual benefit by type of fund.
+MEDIAN_AMOUNTS = {
+    'CHICAGO': 45000,
+    'COUNTY': 35000,
+    'DOWNSTATE': 15000,
+    'STATE': 35000,
+}
+
+STATUSES = (('RETIREE', 0.78), ('SURVIVOR', 0.15), ('DISABILITY', 0.07))
+
+FIRST_NAMES = (
+    'MARY', 'PATRICIA', 'LINDA', 'BARBARA', 'ELIZABETH', 'JENNIFER', 'MARIA', 'SUSAN', 'MARGARET',
+    'DOROTHY', 'LISA', 'NANCY', 'KAREN', 'BETTY', 'HELEN', 'SANDRA', 'DONNA', 'CAROL', 'RUTH',
+    'SHARON', 'MICHELLE', 'LAURA', 'SARAH', 'KIMBERLY', 'DEBORAH', 'JAMES', 'JOHN', 'ROBERT',
+    'MICHAEL', 'WILLIAM', 'DAVID', 'RICHARD', 'CHARLES', 'JOSEPH', 'THOMAS', 'CHRISTOPHER',
+    'DANIEL', 'PAUL', 'MARK', 'DONALD', 'GEORGE', 'KENNETH', 'STEVEN', 'EDWARD', 'BRIAN',
+    'RONALD', 'ANTHONY', 'KEVIN', 'JASON', 'GARY',
+)
+
+LAST_NAMES = (
+    'SMITH', 'JOHNSON', 'WILLIAMS', 'JONES', 'BROWN', 'DAVIS', 'MILLER', 'WILSON', 'MOORE',
+    'TAYLOR', 'ANDERSON', 'THOMAS', 'JACKSON', 'WHITE', 'HARRIS', 'MARTIN', 'THOMPSON', 'GARCIA',
+    'MARTINEZ', 'ROBINSON', 'CLARK', 'RODRIGUEZ', 'LEWIS', 'LEE', 'WALKER', 'HALL', 'ALLEN',
+    'YOUNG', 'HERNANDEZ', 'KING', 'WRIGHT', 'LOPEZ', 'HILL', 'SCOTT', 'GREEN', 'ADAMS', 'BAKER',
+    'GONZALEZ', 'NELSON', 'CARTER', 'MITCHELL', 'PEREZ', 'ROBERTS', 'TURNER', 'PHILLIPS',
+    'CAMPBELL', 'PARKER', 'EVANS', 'EDWARDS', 'COLLINS', 'KOWALSKI', 'NOWAK', 'OBRIEN',
+    'MURPHY', 'SULLIVAN', 'NGUYEN', 'PATEL', 'KIM', 'WASHINGTON', 'JEFFERSON',
+)
+
+# Share of each fund's beneficiaries who stop receiving a benefit each year,
+# how quickly each fund grows, and the yearly cost of living adjustment.
+ATTRITION = 0.05
+GROWTH = 0.015
+COST_OF_LIVING_ADJUSTMENT = 0.03
+
+# Final salary and status were first reported in 2018.
+FIRST_YEAR_WITH_STATUS = 2018
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes synthetic benefit data for every fund, one file per data year, in the '
+        'format import_data expects. The same beneficiaries appear from year to year, '
+        'with yearly cost of living adjustments, as some leave and others retire.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir',
+                            help='Directory to write benefits_<data year>.csv files to')
+
+        parser.add_argument('--rows',
+                            type=int,
+                            default=1000000,
+                            help='Approximate number of benefits to generate, across all years')
+
+        parser.add_argument('--years',
+                            nargs='+',
+                            type=int,
+                            default=list(DATA_YEARS),
+                            help='Data years to generate')
+
+        parser.add_argument('--funds',
+                            default='data/fixtures/pension_fund.json',
+                            help='Pension fund fixture to read fund names and types from')
+
+        parser.add_argument('--seed',
+                            type=int,
+                            default=0,
+                            help='Seed for the random number generator, so runs are repeatable')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+
+        try:
+            with open(options['funds']) as f:
+                funds = [fund['fields'] for fund in json.load(f)]
+
+        except (OSError, ValueError) as e:
+            raise CommandError('Could not read funds from {0}: {1}'.format(options['funds'], e))
+
+        years = sorted(options['years'])
+
+        # Funds grow each year, so size the first year such that the total
+        # across years comes to about the requested number of rows.
+        growth = sum((1 + GROWTH) ** i for i in range(len(years)))
+        first_year_rows = options['rows'] / growth
+
+        total_size = sum(FUND_SIZES.get(fund['name'], 1) for fund in funds)
+
+        os.makedirs(options['output_dir'], exist_ok=True)
+
+        beneficiaries = {
+            fund['name']: self._beneficiaries(
+                fund,
+                math.ceil(first_year_rows * FUND_SIZES.get(fund['name'], 1) / total_size),
+                years[0]
+            )
+            for fund in funds
+        }
+
+        for i, year in enumerate(years):
+            if i:
+                for fund in funds:
+                    beneficiaries[fund['name']] = self._next_year(fund, beneficiaries[fund['name']], year)
+
+            filepath = os.path.join(options['output_dir'], 'benefits_{}.csv'.format(year))
+
+            with open(filepath, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(FIELDNAMES)
+
+                count = 0
+
+                for fund in funds:
+                    for beneficiary in beneficiaries[fund['name']]:
+                        writer.writerow(self._format_row(fund, beneficiary, year))
+                        count += 1
+
+            self.stdout.write('wrote {0} benefits to {1}'.format(count, filepath))
+
+    def _beneficiaries(self, fund, count, data_year):
+        return [self._new_beneficiary(fund, data_year) for _ in range(count)]
+
+    def _new_beneficiary(self, fund, data_year, retiring=False):
+        '''
+        Return a beneficiary as a list of [first name, last name, amount,
+        years of service, start date, final salary, status]. Beneficiaries
+        who are retiring this year start this year. Others started any time
+        in the previous 40 years.
+        '''
+        rand = self.random
+
+        years_of_service = round(min(max(rand.gauss(24, 8), 1), 45), 2)
+
+        final_salary = rand.lognormvariate(math.log(MEDIAN_AMOUNTS[fund['fund_type']] * 2), 0.4)
+
+        # Benefits grow with service, up to about three quarters of salary.
+        amount = final_salary * min(years_of_service * 0.022, 0.75) * rand.uniform(0.8, 1.2)
+
+        if retiring:
+            start_date = date(data_year, 1, 1) + timedelta(days=rand.randrange(365))
+        else:
+            start_date = date(data_year, 1, 1) - timedelta(days=rand.randrange(40 * 365))
+
+            # Benefits in payment have grown with each year since they started.
+            amount *= (1 + COST_OF_LIVING_ADJUSTMENT) ** (data_year - start_date.year)
+
+        status = rand.choices([status for status, _ in STATUSES], [weight for _, weight in STATUSES])[0]
+
+        return [
+            rand.choice(FIRST_NAMES),
+            rand.choice(LAST_NAMES),
+            round(min(amount, 400000), 2),
+            years_of_service,
+            start_date,
+            round(final_salary, 2),
+            status,
+        ]
+
+    def _next_year(self, fund, beneficiaries, data_year):
+        survivors = [beneficiary for beneficiary in beneficiaries if self.random.random() > ATTRITION]
+
+        for beneficiary in survivors:
+            beneficiary[2] = round(beneficiary[2] * (1 + COST_OF_LIVING_ADJUSTMENT), 2)
+
+        target = round(len(beneficiaries) * (1 + GROWTH))
+
+        retirees = [
+            self._new_beneficiary(fund, data_year, retiring=True)
+            for _ in range(max(target - len(survivors), 0))
+        ]
+
+        return survivors + retirees
+
+    def _format_row(self, fund, beneficiary, data_year):
+        first_name, last_name, amount, years_of_service, start_date, final_salary, status = beneficiary
+
+        details = data_year >= FIRST_YEAR_WITH_STATUS
+
+        # Ordered by FIELDNAMES.
+        return [
+            first_name,
+            last_name,
+            '{:.2f}'.format(amount),
+            years_of_service,
+            data_year,
+            fund['name'],
+            start_date.isoformat(),
+            '{:.2f}'.format(final_salary) if details else '',
+            status if details else '',
+        ]
@@ -1,11 +1,72 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import csv
+import io
 from itertools import islice
+import multiprocessing
 
-from django.core.cache import cache
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
 
-from pensions.models import Benefit, PensionFund
+from pensions.cache import bump_funds, bump_year
+from pensions.cleaning import BenefitCleaner
+from pensions.models import Benefit, BenefitLink, BenefitSummary, PensionFund
+from pensions.partitions import create_partition, create_staging_table, index_staging_table, \
+    is_partitioned, staging_name, swap_staging_table
+
+
+class CopyStream:
+    '''
+    Read-only file-like object that formats rows as CSV on demand, so they can
+    be streamed to Postgres with COPY without holding the file in memory.
+    '''
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def read(self, size=-1):
+        while size < 0 or self.buffer.tell() < size:
+            row = next(self.rows, None)
+
+            if row is None:
+                break
+
+            self.writer.writerow(row)
+
+        data = self.buffer.getvalue()
+
+        if size < 0:
+            chunk, remainder = data, ''
+        else:
+            chunk, remainder = data[:size], data[size:]
+
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.buffer.write(remainder)
+
+        return chunk
+
+
+def load_staging_table(filepath, data_year, clean=False):
+    '''
+    Load a data file into the staging table for its year, then index it. Runs
+    in a worker process. Returns the number of rows loaded.
+    '''
+    command = Command()
+    command.fund_cache = {}
+    command.clean = clean
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        create_staging_table(cursor, data_year)
+
+        with open(filepath, 'r') as f:
+            count = command._copy(command._read(f, data_year), staging_name(data_year))
+
+        index_staging_table(cursor, data_year)
+
+    return count
 
 
 class Command(BaseCommand):
@@ -18,35 +79,411 @@ class Command(BaseCommand):
         'status'
     )
 
-    def add_arguments(self, parser):
-        parser.add_argument('data_file',
-                            help='Absolute path to individal data file to import')
+    COPY_FIELDS = (
+        'fund_id',
+        'data_year',
+        'first_name',
+        'last_name',
+        'full_name',
+        'amount',
+        'years_of_service',
+        'final_salary',
+        'start_date',
+        'status',
+        'row_hash',
+    )
 
-        parser.add_argument('data_year',
-                            help='Data year to which individual data file pertains')
+    def add_arguments(self, parser):
+        parser.add_argument('data',
+                            nargs='+',
+                            metavar='data_file data_year',
+                            help='Absolute path to individal data file to import, followed by '
+                                 'the data year to which it pertains. Pass several pairs to '
+                                 'import several years.')
 
         parser.add_argument('--delete',
                             default='True',
                             help='Whether to delete existing data for the given year.'
                                  'Set to False if uploading partial data.')
 
-    @transaction.atomic
+        parser.add_argument('--warm-cache',
+                            default='True',
+                            help='Whether to rebuild cached home page data after the import. '
+                                 'Set to False if importing several years in a row.')
+
+        parser.add_argument('--copy',
+                            action='store_true',
+                            help='Stream rows into Postgres with COPY, rather than '
+                                 'inserting them in batches. Much faster for full years. '
+                                 'Full years are always copied into a partitioned Benefit table.')
+
+        parser.add_argument('--workers',
+                            type=int,
+                            help='Load each year into a staging table with COPY, using this '
+                                 'many processes, then swap the years in one at a time. '
+                                 'Replaces existing data for each year. If the Benefit table '
+                                 'is not partitioned, imports each year in place with COPY, '
+                                 'one at a time, instead. See partition_benefits.')
+
+        parser.add_argument('--clean',
+                            action='store_true',
+                            help='Clean raw data exports on the fly, as clean_data does.')
+
+        parser.add_argument('--diff',
+                            action='store_true',
+                            help='Only insert, update, or delete the benefits that differ from '
+                                 'the data file, for each fund in the file. Use this to load '
+                                 'corrected data for some funds without replacing the year.')
+
     def handle(self, *args, **options):
-        self.fund_cache = {}
+        self.clean = options['clean']
+
+        if len(options['data']) % 2:
+            raise CommandError('Expected pairs of data files and data years')
+
+        years = list(zip(options['data'][::2], options['data'][1::2]))
+
+        if options['workers'] and options['diff']:
+            raise CommandError('Differential imports cannot be staged')
+
+        if options['workers']:
+            if options['delete'] != 'True':
+                raise CommandError('Staged imports always replace existing data')
+
+            with connection.cursor() as cursor:
+                partitioned = is_partitioned(cursor)
+
+            if partitioned:
+                self._import_staged(years, options['workers'])
+
+            else:
+                # Without partitions, a staging table could only be swapped in
+                # by copying every row into the Benefit table again, in as long
+                # a transaction as importing in place.
+                self.stdout.write('Benefit table is not partitioned, so importing each year in place')
+
+                for filepath, data_year in years:
+                    self._import(filepath, data_year, dict(options, copy=True))
+
+        elif options['diff']:
+            for filepath, data_year in years:
+                self._import_diff(filepath, data_year)
+
+        else:
+            with connection.cursor() as cursor:
+                partitioned = is_partitioned(cursor)
+
+            for filepath, data_year in years:
+                if partitioned and options['delete'] == 'True':
+                    self._import_swapped(filepath, data_year)
+                    continue
 
-        data_year = options['data_year']
+                if partitioned:
+                    # Creating a partition locks the Benefit table, so do it
+                    # before the import's transaction, rather than in it.
+                    with connection.cursor() as cursor:
+                        create_partition(cursor, data_year)
+
+                self._import(filepath, data_year, options)
+
+        if options['warm_cache'] == 'True':
+            call_command('warm_cache', stdout=self.stdout)
+
+    @transaction.atomic
+    def _import(self, filepath, data_year, options):
+        self.fund_cache = {}
 
         if options['delete'] == 'True':
             n_deleted, _ = Benefit.objects.filter(data_year=data_year).delete()
             self.stdout.write('deleted {0} existing Benefit objects from {1}'.format(n_deleted, data_year))
 
-        filepath = options['data_file']
-
         self.stdout.write('importing Benefits from {0}'.format(filepath))
 
+        if options['copy']:
+            with open(filepath, 'r') as f:
+                count = self._copy(self._read(f, data_year), Benefit._meta.db_table)
+
+            self.stdout.write('copied {0} Benefit objects'.format(count))
+
+        else:
+            self._bulk_create(filepath, data_year)
+
+        BenefitSummary.objects.refresh(data_year)
+        self.stdout.write('refreshed Benefit summaries for {0}'.format(data_year))
+
+        # Invalidate cached data for the year once the new data are visible,
+        # so they can't be cached under the new generation before then.
+        transaction.on_commit(lambda: bump_year(data_year))
+
+    def _import_staged(self, years, workers):
+        # Forked workers must not share the parent's database connection.
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = {
+                    executor.submit(load_staging_table, filepath, data_year, self.clean): data_year
+                    for filepath, data_year in years
+                }
+
+                for future in as_completed(futures):
+                    data_year = futures[future]
+                    count = future.result()
+
+                    self.stdout.write('staged {0} Benefit objects for {1}'.format(count, data_year))
+
+                    self._swap(data_year)
+
+        finally:
+            with connection.cursor() as cursor:
+                for _, data_year in years:
+                    cursor.execute('DROP TABLE IF EXISTS {}'.format(staging_name(data_year)))
+
+    def _import_swapped(self, filepath, data_year):
+        '''
+        Replace a year in a partitioned Benefit table through its staging
+        table, in this process, so readers of the year keep reading the
+        previous data, rather than waiting, until the new data are complete.
+        '''
+        try:
+            count = load_staging_table(filepath, data_year, self.clean)
+
+            self.stdout.write('staged {0} Benefit objects for {1}'.format(count, data_year))
+
+            self._swap(data_year)
+
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('DROP TABLE IF EXISTS {}'.format(staging_name(data_year)))
+
+    def _swap(self, data_year):
+        # Build the year's summaries from the staging table, before the swap
+        # locks the Benefit table, so readers only wait on the swap itself.
+        with transaction.atomic(), connection.cursor() as cursor:
+            BenefitSummary.objects.refresh(data_year, staging_name(data_year))
+            swap_staging_table(cursor, data_year)
+
+        bump_year(data_year)
+
+        self.stdout.write('swapped in Benefits for {0}'.format(data_year))
+
+    @transaction.atomic
+    def _import_diff(self, filepath, data_year):
+        '''
+        Compare the benefits in the data file to those stored for each fund
+        in the file, by row hash, and apply only the differences. Changed rows
+        are matched to the stored benefit with the same name and start date,
+        so they are updated in place, rather than deleted and reinserted.
+        '''
+        self.fund_cache = {}
+
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                CREATE TEMP TABLE benefit_import ON COMMIT DROP AS
+                SELECT {fields} FROM {table}
+                WITH NO DATA
+            '''.format(fields=', '.join(self.COPY_FIELDS), table=Benefit._meta.db_table))
+
+            cursor.execute('ALTER TABLE benefit_import ADD COLUMN line bigserial')
+
+            self.stdout.write('importing Benefits from {0}'.format(filepath))
+
+            with open(filepath, 'r') as f:
+                count = self._copy(self._read(f, data_year), 'benefit_import')
+
+            self.stdout.write('read {0} Benefit objects'.format(count))
+
+            cursor.execute('SELECT DISTINCT data_year FROM benefit_import')
+
+            if {row for row, in cursor.fetchall()} - {int(data_year)}:
+                raise CommandError('Data file contains benefits from years other than {}'.format(data_year))
+
+            # Match identical rows one to one, so duplicates are neither lost
+            # nor multiplied. What's left over was removed or added.
+            cursor.execute('''
+                CREATE TEMP TABLE benefit_diff ON COMMIT DROP AS
+                WITH stored AS (
+                  SELECT
+                    id,
+                    fund_id,
+                    row_hash,
+                    row_number() OVER (PARTITION BY fund_id, row_hash ORDER BY id) AS n
+                  FROM {table}
+                  WHERE data_year = %(data_year)s
+                  AND fund_id IN (SELECT DISTINCT fund_id FROM benefit_import)
+                ),
+                imported AS (
+                  SELECT
+                    line,
+                    fund_id,
+                    row_hash,
+                    row_number() OVER (PARTITION BY fund_id, row_hash ORDER BY line) AS n
+                  FROM benefit_import
+                )
+                SELECT
+                  stored.id,
+                  imported.line
+                FROM stored
+                FULL JOIN imported
+                USING (fund_id, row_hash, n)
+                WHERE stored.id IS NULL
+                OR imported.line IS NULL
+            '''.format(table=Benefit._meta.db_table), {'data_year': data_year})
+
+            # Pair removed and added rows for the same person, i.e., with the
+            # same fund, name and start date, as updates.
+            cursor.execute('''
+                CREATE TEMP TABLE benefit_changes ON COMMIT DROP AS
+                WITH removed AS (
+                  SELECT
+                    benefit.id,
+                    benefit.fund_id,
+                    benefit.first_name,
+                    benefit.last_name,
+                    COALESCE(benefit.start_date, '-infinity') AS start_date,
+                    row_number() OVER (
+                      PARTITION BY benefit.fund_id, benefit.first_name, benefit.last_name, benefit.start_date
+                      ORDER BY benefit.id
+                    ) AS n
+                  FROM benefit_diff
+                  JOIN {table} AS benefit
+                  ON benefit.id = benefit_diff.id
+                  AND benefit.data_year = %(data_year)s
+                ),
+                added AS (
+                  SELECT
+                    benefit_import.line,
+                    benefit_import.fund_id,
+                    benefit_import.first_name,
+                    benefit_import.last_name,
+                    COALESCE(benefit_import.start_date, '-infinity') AS start_date,
+                    row_number() OVER (
+                      PARTITION BY
+                        benefit_import.fund_id,
+                        benefit_import.first_name,
+                        benefit_import.last_name,
+                        benefit_import.start_date
+                      ORDER BY benefit_import.line
+                    ) AS n
+                  FROM benefit_diff
+                  JOIN benefit_import
+                  USING (line)
+                )
+                SELECT
+                  removed.id,
+                  added.line,
+                  COALESCE(removed.fund_id, added.fund_id) AS fund_id
+                FROM removed
+                FULL JOIN added
+                USING (fund_id, first_name, last_name, start_date, n)
+            '''.format(table=Benefit._meta.db_table), {'data_year': data_year})
+
+            updated_fields = [field for field in self.COPY_FIELDS if field not in ('fund_id', 'data_year')]
+
+            cursor.execute('''
+                UPDATE {table} AS benefit
+                SET {assignments}
+                FROM benefit_changes
+                JOIN benefit_import
+                USING (line)
+                WHERE benefit.id = benefit_changes.id
+                AND benefit.data_year = %(data_year)s
+            '''.format(table=Benefit._meta.db_table,
+                       assignments=', '.join('{0} = benefit_import.{0}'.format(field) for field in updated_fields)),
+                {'data_year': data_year})
+
+            cursor.execute('''
+                DELETE FROM {table} AS benefit
+                USING benefit_changes
+                WHERE benefit.id = benefit_changes.id
+                AND benefit.data_year = %(data_year)s
+                AND benefit_changes.line IS NULL
+            '''.format(table=Benefit._meta.db_table), {'data_year': data_year})
+
+            cursor.execute('''
+                INSERT INTO {table} ({fields})
+                SELECT {import_fields}
+                FROM benefit_import
+                JOIN benefit_changes
+                USING (line)
+                WHERE benefit_changes.id IS NULL
+                RETURNING id
+            '''.format(table=Benefit._meta.db_table,
+                       fields=', '.join(self.COPY_FIELDS),
+                       import_fields=', '.join('benefit_import.{}'.format(field) for field in self.COPY_FIELDS)))
+
+            changed_benefits = [benefit_id for benefit_id, in cursor.fetchall()]
+
+            cursor.execute('SELECT id FROM benefit_changes WHERE id IS NOT NULL')
+
+            changed_benefits += [benefit_id for benefit_id, in cursor.fetchall()]
+
+            cursor.execute('''
+                SELECT
+                  fund.id,
+                  fund.name,
+                  COUNT(*) FILTER (WHERE changes.id IS NULL AND changes.line IS NOT NULL),
+                  COUNT(*) FILTER (WHERE changes.id IS NOT NULL AND changes.line IS NOT NULL),
+                  COUNT(*) FILTER (WHERE changes.id IS NOT NULL AND changes.line IS NULL),
+                  imported.count
+                FROM (
+                  SELECT fund_id, COUNT(*) AS count
+                  FROM benefit_import
+                  GROUP BY fund_id
+                ) AS imported
+                JOIN {fund_table} AS fund
+                ON fund.id = imported.fund_id
+                LEFT JOIN benefit_changes AS changes
+                USING (fund_id)
+                GROUP BY fund.id, fund.name, imported.count
+                ORDER BY fund.name
+            '''.format(fund_table=PensionFund._meta.db_table))
+
+            changed_funds = []
+
+            for fund_id, fund, inserted, updated, deleted, imported in cursor.fetchall():
+                self.stdout.write(
+                    '{0}: {1} inserted, {2} updated, {3} deleted, {4} unchanged'.format(
+                        fund, inserted, updated, deleted, imported - inserted - updated
+                    )
+                )
+
+                if inserted or updated or deleted:
+                    changed_funds.append(fund_id)
+
+            # Drop the temporary tables now, rather than on commit, in case
+            # this import is part of a larger transaction.
+            cursor.execute('DROP TABLE benefit_import, benefit_diff, benefit_changes')
+
+        # Only the summaries of the funds that changed, and the links of the
+        # benefits that changed, are stale.
+        if changed_funds:
+            BenefitSummary.objects.refresh(data_year, fund_ids=changed_funds)
+            BenefitLink.objects.refresh(data_year, benefit_ids=changed_benefits)
+
+            self.stdout.write('refreshed Benefit summaries for {0} funds'.format(len(changed_funds)))
+
+        # Only cached data for the funds that changed are now stale.
+        transaction.on_commit(lambda: bump_funds(changed_funds, data_year))
+
+    def _read(self, f, data_year):
+        if self.clean:
+            return self._clean(f, data_year)
+
+        return csv.DictReader(f)
+
+    def _clean(self, f, data_year):
+        cleaner = BenefitCleaner(data_year)
+
+        yield from cleaner.clean(csv.reader(f))
+
+        self.stdout.write(cleaner.report())
+
+    def _bulk_create(self, filepath, data_year):
         with open(filepath, 'r') as f:
-            reader = csv.DictReader(f)
-            objects = self._format_row(reader)
+            objects = self._format_row(self._read(f, data_year))
 
             count = 0
             batch_size = 10000
@@ -63,15 +500,50 @@ class Command(BaseCommand):
 
                 self.stdout.write('inserted {0} Benefit objects'.format(count))
 
-        cache.clear()
+    def _copy(self, reader, table):
+        '''
+        Stream rows from the reader into the given table with COPY. Returns
+        the number of rows copied.
+        '''
+        # The connection is busy for the duration of COPY, so funds can't be
+        # looked up as rows stream in. Load them all up front, instead.
+        self.fund_cache.update((fund.name, fund) for fund in PensionFund.objects.all())
+
+        stream = CopyStream(self._format_copy_row(row) for row in reader)
+
+        # In CSV format, COPY reads unquoted empty values as null. Names are
+        # never null, so read empty names as empty strings.
+        sql = '''
+            COPY {table} ({fields}) FROM STDIN
+            WITH (FORMAT csv, FORCE_NOT_NULL (first_name, last_name, full_name))
+        '''.format(table=table, fields=', '.join(self.COPY_FIELDS))
+
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, stream)
+            return cursor.rowcount
 
     def _format_row(self, reader):
         for row in reader:
             row['fund'] = self._hydrate_fund(row['fund'])
             row = self._cast_to_none(row)
+            row = self._round_decimals(row)
             row = self._concatenate_name_fields(row)
+            row['row_hash'] = Benefit.hash_row(row)
             yield Benefit(**row)
 
+    def _format_copy_row(self, row):
+        try:
+            row['fund_id'] = self.fund_cache[row['fund']].id
+
+        except KeyError:
+            existing_funds = ', '.join(self.fund_cache)
+            message = 'Fund name {} does not exist. Existing funds are: {}'.format(row['fund'], existing_funds)
+            raise ValueError(message)
+
+        row = self._concatenate_name_fields(row)
+        row['row_hash'] = Benefit.hash_row(row)
+        return [row[field] for field in self.COPY_FIELDS]
+
     def _hydrate_fund(self, fund_key):
         try:
             fund = self.fund_cache[fund_key]
@@ -97,6 +569,14 @@ class Command(BaseCommand):
 
         return row
 
+    def _round_decimals(self, row):
+        # Store the values that were hashed, as COPY would.
+        for field in Benefit.ROW_HASH_DECIMAL_FIELDS:
+            if row[field] is not None:
+                row[field] = Benefit.round_decimal(row[field])
+
+        return row
+
     def _concatenate_name_fields(self, row):
         row['full_name'] = ' '.join([row['first_name'], row['last_name']])
         return row
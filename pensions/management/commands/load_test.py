@@ -0,0 +1,83 @@
+from datetime import datetime
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pensions.benchmarks import BenchmarkError, benefit_pages, largest_summary, load_test
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests pages of the benefits table from a running server, several at a '
+        'time, to compare how many requests a server handles at once, e.g., under '
+        'gunicorn and under uvicorn. Pages start at random offsets, so they miss the '
+        'cache. Reads the fund and year to request from this project\'s database, '
+        'which must hold the same data as the server\'s.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url',
+                            help='Base URL of the server, e.g., http://localhost:8000')
+
+        parser.add_argument('--concurrency',
+                            nargs='+',
+                            type=int,
+                            default=[1, 8, 32],
+                            help='Numbers of requests to make at once, one run each')
+
+        parser.add_argument('--requests',
+                            type=int,
+                            default=200,
+                            help='Number of requests in each run')
+
+        parser.add_argument('--length',
+                            type=int,
+                            default=100,
+                            help='Rows per page of benefits')
+
+        parser.add_argument('--output',
+                            help='File to write results to, as JSON')
+
+    def handle(self, *args, **options):
+        headers = {
+            # Servers behind an SSL redirect expect to sit behind a proxy.
+            'X-Forwarded-Proto': 'https',
+        }
+
+        # Authenticate, so page changes aren't throttled.
+        if settings.MAILCHIMP_AUTH_COOKIE_NAME:
+            headers['Cookie'] = '{}=load-test'.format(settings.MAILCHIMP_AUTH_COOKIE_NAME)
+
+        try:
+            summary = largest_summary()
+
+            results = []
+
+            for concurrency in options['concurrency']:
+                paths = benefit_pages(summary, options['length'], options['requests'])
+
+                result = load_test(options['url'], paths, concurrency, headers)
+
+                self.stdout.write(
+                    'concurrency {concurrency:<6}{requests_per_second:>8.1f} requests/s, '
+                    'median {median_ms:.1f}ms, p95 {p95_ms:.1f}ms, max {max_ms:.1f}ms'.format(**result)
+                )
+
+                results.append(result)
+
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            report = {
+                'time': datetime.now().isoformat(),
+                'url': options['url'],
+                'options': {key: options[key] for key in ('requests', 'length')},
+                'results': results,
+            }
+
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+            self.stdout.write('wrote results to {}'.format(options['output']))
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from pensions.partitions import BENEFIT_TABLE, create_partition, get_constraints, get_indexes, is_partitioned
+
+
+class Command(BaseCommand):
+    help = 'Converts the Benefit table to a table partitioned by data year'
+
+    UNPARTITIONED_TABLE = '{}_unpartitioned'.format(BENEFIT_TABLE)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            if connection.pg_version < 110000:
+                raise CommandError('Partitioning Benefit data requires Postgres 11 or newer')
+
+            if is_partitioned(cursor):
+                self.stdout.write('{} is already partitioned'.format(BENEFIT_TABLE))
+                return
+
+            cursor.execute('LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(BENEFIT_TABLE))
+
+            indexes = get_indexes(cursor, BENEFIT_TABLE)
+            constraints = get_constraints(cursor, BENEFIT_TABLE)
+
+            cursor.execute('ALTER TABLE {0} RENAME TO {1}'.format(BENEFIT_TABLE, self.UNPARTITIONED_TABLE))
+
+            # Free up the index and constraint names, so they can be recreated
+            # on the partitioned table exactly as migrations left them.
+            for name, _ in constraints:
+                cursor.execute('ALTER TABLE {0} DROP CONSTRAINT {1}'.format(self.UNPARTITIONED_TABLE, name))
+
+            for name, _ in indexes:
+                cursor.execute('DROP INDEX {}'.format(name))
+
+            # Postgres requires the partition key to be part of the primary
+            # key of a partitioned table.
+            cursor.execute('''
+                CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS)
+                PARTITION BY LIST (data_year)
+            '''.format(BENEFIT_TABLE, self.UNPARTITIONED_TABLE))
+
+            cursor.execute('''
+                ALTER TABLE {0} ADD CONSTRAINT {0}_pkey PRIMARY KEY (id, data_year)
+            '''.format(BENEFIT_TABLE))
+
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [self.UNPARTITIONED_TABLE])
+            sequence, = cursor.fetchone()
+
+            cursor.execute('ALTER SEQUENCE {0} OWNED BY {1}.id'.format(sequence, BENEFIT_TABLE))
+
+            for _, definition in indexes:
+                cursor.execute(definition)
+
+            for name, definition in constraints:
+                if not name.endswith('_pkey'):
+                    cursor.execute('ALTER TABLE {0} ADD CONSTRAINT {1} {2}'.format(BENEFIT_TABLE, name, definition))
+
+            cursor.execute('SELECT DISTINCT data_year FROM {}'.format(self.UNPARTITIONED_TABLE))
+
+            for data_year, in cursor.fetchall():
+                create_partition(cursor, data_year)
+                self.stdout.write('created partition for {}'.format(data_year))
+
+            cursor.execute('INSERT INTO {0} SELECT * FROM {1}'.format(BENEFIT_TABLE, self.UNPARTITIONED_TABLE))
+            self.stdout.write('copied {} Benefit objects into partitions'.format(cursor.rowcount))
+
+            cursor.execute('DROP TABLE {}'.format(self.UNPARTITIONED_TABLE))
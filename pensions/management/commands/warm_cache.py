@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from pensions.views import Index
+
+
+class Command(BaseCommand):
+    help = 'Computes and caches the data displayed on the home page'
+
+    def handle(self, *args, **options):
+        Index().warm_cache()
+
+        self.stdout.write('cached {0}'.format(', '.join(Index.cache_keys)))
@@ -0,0 +1,144 @@
+'''
+In-process metrics, rendered in the Prometheus text format at /metrics/.
+
+Each worker process keeps its own metrics, so a scrape shows the worker that
+served it, since it started. Recording a value takes a lock and a few
+additions, so metrics are cheap enough to leave on.
+'''
+from bisect import bisect_left
+from collections import OrderedDict
+import threading
+
+
+# Upper bounds of histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, description, labelnames):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name, self._labels(labels), value
+
+    def _labels(self, labels, **extra):
+        pairs = list(zip(self.labelnames, labels)) + list(extra.items())
+        return ','.join('{0}="{1}"'.format(name, _escape(value)) for name, value in pairs)
+
+
+class Histogram(Counter):
+    type = 'histogram'
+
+    def __init__(self, name, description, labelnames, buckets):
+        super().__init__(name, description, labelnames)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        if labels not in self.values:
+            self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+
+        counts, total = self.values[labels]
+
+        # Count the value in the first bucket whose bound it doesn't exceed.
+        # Buckets are made cumulative when rendered.
+        counts[bisect_left(self.buckets, value)] += 1
+        self.values[labels][1] = total + value
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '{}_bucket'.format(self.name), self._labels(labels, le=bound), cumulative
+
+            yield '{}_sum'.format(self.name), self._labels(labels), total
+            yield '{}_count'.format(self.name), self._labels(labels), cumulative
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def inc(self, name, labels, amount=1):
+        with self.lock:
+            self.metrics[name].inc(labels, amount)
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            self.metrics[name].observe(labels, value)
+
+    def render(self):
+        lines = []
+
+        with self.lock:
+            for metric in self.metrics.values():
+                lines.append('# HELP {0} {1}'.format(metric.name, metric.description))
+                lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+
+                for name, labels, value in metric.samples():
+                    lines.append('{0}{{{1}}} {2}'.format(name, labels, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+registry.register(Histogram(
+    'request_duration_seconds',
+    'Time to handle a request, by view.',
+    ('view', 'method', 'status'),
+    LATENCY_BUCKETS,
+))
+
+registry.register(Histogram(
+    'request_queries',
+    'Number of SQL queries run for a request, by view.',
+    ('view',),
+    QUERY_COUNT_BUCKETS,
+))
+
+registry.register(Histogram(
+    'request_query_duration_seconds',
+    'Time spent running SQL queries for a request, by view.',
+    ('view',),
+    LATENCY_BUCKETS,
+))
+
+registry.register(Counter(
+    'cache_requests_total',
+    'Values read from the cache, or computed because they were missing, by key.',
+    ('key', 'result'),
+))
+
+
+def record_request(view, method, status, duration, queries, query_duration):
+    registry.observe('request_duration_seconds', (view, method, status), duration)
+    registry.observe('request_queries', (view,), queries)
+    registry.observe('request_query_duration_seconds', (view,), query_duration)
+
+
+def record_cache(key, hit):
+    # Label by the kind of value, e.g., "fund", rather than the full key,
+    # e.g., "fund:11:2019", so the number of series stays small.
+    registry.inc('cache_requests_total', (key.split(':')[0], 'hit' if hit else 'miss'))
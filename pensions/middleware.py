@@ -0,0 +1,56 @@
+from contextlib import ExitStack
+import time
+
+from django.db import connections
+
+from pensions.metrics import record_request
+
+
+class QueryStats:
+    '''
+    Database execute wrapper that counts queries and the time they take.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    '''
+    Record the latency, number of queries and time spent in queries of each
+    request, by view. See pensions/metrics.py.
+    '''
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryStats()
+
+        start = time.perf_counter()
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+
+            response = self.get_response(request)
+
+        duration = time.perf_counter() - start
+
+        # Requests that match no URL, e.g., scans for common exploits, are
+        # counted together.
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+
+        record_request(view, request.method, str(response.status_code), duration, queries.count, queries.duration)
+
+        return response
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+NAME_FIELDS = ('first_name', 'last_name', 'full_name')
+
+
+def create_index_sql(field):
+    # Expression indexes are not expressible in Meta.indexes before Django 3.2.
+    # text_pattern_ops allows prefix LIKE queries to use the index regardless
+    # of the database collation.
+    return '''
+        CREATE INDEX pensions_benefit_{0}_prefix
+        ON pensions_benefit (fund_id, data_year, UPPER({0}) text_pattern_ops)
+    '''.format(field)
+
+
+def drop_index_sql(field):
+    return 'DROP INDEX IF EXISTS pensions_benefit_{0}_prefix'.format(field)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0006_allow_decimal_years'),
+    ]
+
+    operations = [
+        migrations.RunSQL(create_index_sql(field), reverse_sql=drop_index_sql(field))
+        for field in NAME_FIELDS
+    ]
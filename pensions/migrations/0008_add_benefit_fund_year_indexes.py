@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0007_add_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='benefit',
+            index=models.Index(fields=['fund', 'data_year', 'amount'], name='benefit_fund_year_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='benefit',
+            index=models.Index(fields=['data_year', 'fund'], name='benefit_year_fund_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0008_add_benefit_fund_year_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BenefitSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_year', models.IntegerField()),
+                ('count', models.IntegerField()),
+                ('fund', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='benefit_summaries', to='pensions.PensionFund')),
+            ],
+            options={
+                'unique_together': {('fund', 'data_year')},
+            },
+        ),
+    ]
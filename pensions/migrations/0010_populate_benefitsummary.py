@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def populate_summaries(apps, schema_editor):
+    Benefit = apps.get_model('pensions', 'Benefit')
+    BenefitSummary = apps.get_model('pensions', 'BenefitSummary')
+
+    aggregates = Benefit.objects.values('fund', 'data_year').annotate(count=Count('id'))
+
+    BenefitSummary.objects.bulk_create([
+        BenefitSummary(fund_id=a['fund'], data_year=a['data_year'], count=a['count'])
+        for a in aggregates
+    ])
+
+
+def remove_summaries(apps, schema_editor):
+    BenefitSummary = apps.get_model('pensions', 'BenefitSummary')
+    BenefitSummary.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0009_add_benefitsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_summaries, reverse_code=remove_summaries),
+    ]
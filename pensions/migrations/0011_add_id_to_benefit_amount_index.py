@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0010_populate_benefitsummary'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='benefit',
+            name='benefit_fund_year_amount_idx',
+        ),
+        migrations.AddIndex(
+            model_name='benefit',
+            index=models.Index(fields=['fund', 'data_year', 'amount', 'id'], name='benefit_fund_year_amount_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+DISTRIBUTION_BIN_NUM = 10
+DISTRIBUTION_MAX = 250000
+
+
+def populate_distributions(apps, schema_editor):
+    BenefitSummary = apps.get_model('pensions', 'BenefitSummary')
+
+    bin_counts = ', '.join(
+        'COUNT(*) FILTER (WHERE width_bucket(amount, 0, {0}, {1}) = {2})'.format(
+            DISTRIBUTION_MAX,
+            DISTRIBUTION_BIN_NUM,
+            bucket_index
+        )
+        for bucket_index in range(1, DISTRIBUTION_BIN_NUM + 2)
+    )
+
+    BenefitSummary.objects.all().delete()
+
+    schema_editor.execute('''
+        INSERT INTO pensions_benefitsummary (fund_id, data_year, count, median, max_amount, bin_counts)
+        SELECT
+          fund_id,
+          data_year,
+          COUNT(*),
+          percentile_cont(0.5) WITHIN GROUP (ORDER BY amount),
+          MAX(amount),
+          ARRAY[{bin_counts}]
+        FROM pensions_benefit
+        GROUP BY fund_id, data_year
+    '''.format(bin_counts=bin_counts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0011_add_id_to_benefit_amount_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='benefitsummary',
+            name='median',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='benefitsummary',
+            name='max_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='benefitsummary',
+            name='bin_counts',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_distributions, reverse_code=migrations.RunPython.noop),
+    ]
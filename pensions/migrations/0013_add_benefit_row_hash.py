@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+# Mirrors Benefit.hash_row: the stored values of each hashed field, as text,
+# joined by the unit separator, with nulls as empty strings.
+HASH_ROWS = r'''
+    UPDATE pensions_benefit
+    SET row_hash = md5(concat_ws(chr(31),
+      first_name,
+      last_name,
+      amount::text,
+      COALESCE(years_of_service::text, ''),
+      COALESCE(final_salary::text, ''),
+      COALESCE(start_date::text, ''),
+      COALESCE(status, '')
+    ))
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0012_add_benefitsummary_distribution'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='benefit',
+            name='row_hash',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.RunSQL(HASH_ROWS, reverse_sql=migrations.RunSQL.noop),
+    ]
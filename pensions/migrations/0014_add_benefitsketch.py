@@ -0,0 +1,71 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+RESOLUTION = 0.01
+ZERO_BUCKET = -1
+
+
+def populate_sketches(apps, schema_editor):
+    schema_editor.execute('''
+        INSERT INTO pensions_benefitsketch (
+          fund_id, data_year, status, count, total, min_amount, max_amount, buckets, bucket_counts
+        )
+        SELECT
+          fund_id,
+          data_year,
+          status,
+          SUM(count),
+          SUM(total),
+          MIN(min_amount),
+          MAX(max_amount),
+          array_agg(bucket ORDER BY bucket),
+          array_agg(count ORDER BY bucket)
+        FROM (
+          SELECT
+            fund_id,
+            data_year,
+            UPPER(COALESCE(status, '')) AS status,
+            CASE
+              WHEN amount < 1 THEN {zero_bucket}
+              ELSE floor(ln(amount::float8) / ln(1 + {resolution}))::integer
+            END AS bucket,
+            COUNT(*) AS count,
+            SUM(amount) AS total,
+            MIN(amount) AS min_amount,
+            MAX(amount) AS max_amount
+          FROM pensions_benefit
+          GROUP BY 1, 2, 3, 4
+        ) AS buckets
+        GROUP BY fund_id, data_year, status
+    '''.format(zero_bucket=ZERO_BUCKET, resolution=RESOLUTION))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0013_add_benefit_row_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BenefitSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_year', models.IntegerField()),
+                ('status', models.CharField(blank=True, max_length=256)),
+                ('count', models.IntegerField()),
+                ('total', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('min_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('buckets', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('bucket_counts', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('fund', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='benefit_sketches', to='pensions.PensionFund')),
+            ],
+            options={
+                'unique_together': {('fund', 'data_year', 'status')},
+            },
+        ),
+        migrations.RunPython(populate_sketches, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Mirrors Benefit.person_key. See PERSON_KEY_SQL in pensions/models.py.
+def populate_links(apps, schema_editor):
+    schema_editor.execute(r'''
+        INSERT INTO pensions_benefitlink (person_key, fund_id, data_year, benefit_id)
+        SELECT
+          md5(concat_ws(chr(31),
+            fund_id::text,
+            trim(regexp_replace(
+              upper(regexp_replace(first_name || ' ' || last_name, '[^A-Za-z ]', '', 'g')), ' +', ' ', 'g'
+            )),
+            COALESCE(to_char(start_date, 'YYYY-MM-DD'), ''),
+            COALESCE(years_of_service::text, '')
+          )),
+          fund_id,
+          data_year,
+          id
+        FROM pensions_benefit
+    ''')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0014_add_benefitsketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BenefitLink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_year', models.IntegerField()),
+                ('person_key', models.CharField(max_length=32)),
+                ('benefit_id', models.IntegerField()),
+                ('fund', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='benefit_links', to='pensions.PensionFund')),
+            ],
+        ),
+        # Link existing benefits before indexing, which is faster than
+        # updating the indexes row by row.
+        migrations.RunPython(populate_links, reverse_code=migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='benefitlink',
+            index=models.Index(fields=['person_key', 'data_year'], name='benefitlink_person_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='benefitlink',
+            index=models.Index(fields=['data_year'], name='benefitlink_year_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pensions', '0015_add_benefitlink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchCounter',
+            fields=[
+                ('visitor', models.CharField(max_length=256, primary_key=True, serialize=False)),
+                ('window_start', models.DateTimeField(db_index=True)),
+                ('count', models.IntegerField()),
+            ],
+        ),
+    ]
@@ -1,4 +1,13 @@
-from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+import hashlib
+import re
+
+from django.contrib.postgres.fields import ArrayField
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.db.models.functions import Upper
+
+from pensions.sketches import RESOLUTION, ZERO_BUCKET, AmountHistogram
 
 
 class VintagedModel(models.Model):
@@ -30,8 +39,22 @@ class PensionFund(models.Model):
         return self.name
 
     def median_annual_benefit(self, year):
-        # self.benefits.filter(data_year=year)...
-        pass
+        summary = self.benefit_summaries.filter(data_year=year).first()
+        return summary.median if summary else None
+
+    def benefit_percentiles(self, year, percentiles, status=None):
+        '''
+        Return a dictionary of the given percentiles of benefits in a year,
+        optionally with a given status, read from benefit sketches.
+        '''
+        sketches = self.benefit_sketches.filter(data_year=year)
+
+        if status is not None:
+            sketches = sketches.filter(status=status.upper())
+
+        histogram = sketches.histogram()
+
+        return {percentile: histogram.percentile(percentile) for percentile in percentiles}
 
 
 class AnnualReport(VintagedModel):
@@ -74,12 +97,38 @@ class AnnualReport(VintagedModel):
             return 0
 
 
+class BenefitQuerySet(models.QuerySet):
+
+    def search(self, search):
+        '''
+        Filter benefits whose first, last or full name starts with a search,
+        normalized to upper case.
+
+        Compare against UPPER(name) rather than using istartswith, so the
+        query matches the expression indexes on (fund_id, data_year,
+        UPPER(name)). See migration 0007.
+        '''
+        if not search:
+            return self
+
+        return self.annotate(
+            first_name_upper=Upper('first_name'),
+            last_name_upper=Upper('last_name'),
+            full_name_upper=Upper('full_name'),
+        ).filter(
+            Q(first_name_upper__startswith=search) |
+            Q(last_name_upper__startswith=search) |
+            Q(full_name_upper__startswith=search)
+        )
+
+
 class Benefit(VintagedModel):
     '''
     Individual pension benefit. Benefit data are reported by each pension fund.
 
-    Beneficiaries are not linked year over year, i.e., Beneficiary objects
-    across years may refer to the same person.
+    Benefits are not linked year over year in this table. Benefits across
+    years that likely belong to the same person share a person key, stored in
+    BenefitLink. See person_key.
 
     Starting in 2018, data contain benefit status, e.g., "retiree", "widow/er",
     or "disability".
@@ -95,5 +144,376 @@ class Benefit(VintagedModel):
     start_date = models.DateField(null=True, blank=True)
     status = models.CharField(max_length=256, null=True, blank=True)
 
+    # Fingerprint of the reported values, used to find the benefits that
+    # changed when a fund sends a corrected file. See hash_row.
+    row_hash = models.CharField(max_length=32, null=True, blank=True)
+
+    ROW_HASH_FIELDS = (
+        'first_name',
+        'last_name',
+        'amount',
+        'years_of_service',
+        'final_salary',
+        'start_date',
+        'status',
+    )
+
+    ROW_HASH_DECIMAL_FIELDS = ('amount', 'years_of_service', 'final_salary')
+
+    objects = BenefitQuerySet.as_manager()
+
+    class Meta:
+        # Benefits are always read one fund and year at a time, ordered by
+        # amount (then id, for stable pages) by default, and aggregated by
+        # year and fund. Name search indexes are expression indexes, so they
+        # live in migration 0007.
+        indexes = [
+            models.Index(fields=['fund', 'data_year', 'amount', 'id'], name='benefit_fund_year_amount_idx'),
+            models.Index(fields=['data_year', 'fund'], name='benefit_year_fund_idx'),
+        ]
+
     def __str__(self):
         return ' '.join([self.first_name, self.last_name])
+
+    @classmethod
+    def round_decimal(cls, value):
+        '''
+        Round a value to cents, as Postgres rounds it when it's stored: half
+        away from zero. Django rounds half to even when saving a model.
+        '''
+        return Decimal(value).quantize(Decimal('0.01'), ROUND_HALF_UP)
+
+    @classmethod
+    def hash_row(cls, row):
+        '''
+        Hash the values of a row of benefit data, as Postgres would store them,
+        so a row from a data file hashes the same as the benefit loaded from
+        it. Migration 0013 computes the same hash in SQL.
+        '''
+        values = []
+
+        for field in cls.ROW_HASH_FIELDS:
+            value = row[field]
+
+            if value is None or value == '':
+                value = ''
+
+            elif field in cls.ROW_HASH_DECIMAL_FIELDS:
+                value = '{:f}'.format(cls.round_decimal(value))
+
+            values.append(str(value))
+
+        return hashlib.md5('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def person_key(cls, fund_id, first_name, last_name, start_date, years_of_service):
+        '''
+        Key a benefit by the person who likely receives it, so their benefits
+        can be linked across years: a hash of the fund, their name, as upper
+        case letters and single spaces, their start date and their years of
+        service. BenefitLinkManager.refresh computes the same key in SQL.
+        '''
+        name = ' '.join(re.sub('[^A-Za-z ]', '', ' '.join([first_name, last_name])).upper().split())
+
+        values = [
+            str(fund_id),
+            name,
+            start_date.isoformat() if start_date else '',
+            '{:f}'.format(cls.round_decimal(years_of_service)) if years_of_service is not None else '',
+        ]
+
+        return hashlib.md5('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+
+def _fund_filter(fund_ids):
+    '''
+    Limit a refresh to the given funds, or to none if fund_ids is None.
+    Returns keyword arguments for deleting stale rows, and a SQL condition,
+    with its parameters, for recomputing them.
+    '''
+    if fund_ids is None:
+        return {}, '', []
+
+    fund_ids = list(fund_ids)
+
+    return {'fund_id__in': fund_ids}, 'AND fund_id = ANY(%s)', [fund_ids]
+
+
+class BenefitSummaryManager(models.Manager):
+
+    def refresh(self, data_year, table=None, fund_ids=None):
+        '''
+        Recompute the summaries for the given year from the Benefit table, or
+        from a table with the same columns, e.g., a staging table, in a single
+        pass over the year's benefits, then the year's sketches and links.
+
+        Given fund IDs, only recompute the summaries and sketches of those
+        funds. Their links are left to the caller, which knows which benefits
+        changed. See BenefitLinkManager.refresh.
+        '''
+        table = table or Benefit._meta.db_table
+        fund_filter, fund_sql, fund_params = _fund_filter(fund_ids)
+
+        bin_counts = ', '.join(
+            'COUNT(*) FILTER (WHERE width_bucket(amount, 0, {0}, {1}) = {2})'.format(
+                self.model.DISTRIBUTION_MAX,
+                self.model.DISTRIBUTION_BIN_NUM,
+                bucket_index
+            )
+            for bucket_index in range(1, self.model.DISTRIBUTION_BIN_NUM + 2)
+        )
+
+        with transaction.atomic():
+            self.filter(data_year=data_year, **fund_filter).delete()
+
+            with connection.cursor() as cursor:
+                cursor.execute('''
+                    INSERT INTO {summary_table} (fund_id, data_year, count, median, max_amount, bin_counts)
+                    SELECT
+                      fund_id,
+                      data_year,
+                      COUNT(*),
+                      percentile_cont(0.5) WITHIN GROUP (ORDER BY amount),
+                      MAX(amount),
+                      ARRAY[{bin_counts}]
+                    FROM {benefit_table}
+                    WHERE data_year = %s
+                    {funds}
+                    GROUP BY fund_id, data_year
+                '''.format(summary_table=self.model._meta.db_table,
+                           benefit_table=table,
+                           bin_counts=bin_counts,
+                           funds=fund_sql), [data_year] + fund_params)
+
+            BenefitSketch.objects.refresh(data_year, table, fund_ids)
+
+            if fund_ids is None:
+                BenefitLink.objects.refresh(data_year, table)
+
+
+class BenefitSummary(VintagedModel):
+    '''
+    Summary of the benefits reported by a fund in a given year. Summaries are
+    refreshed by import_data, so views can read them rather than aggregating
+    the Benefit table on each request.
+
+    bin_counts holds the number of benefits in each of DISTRIBUTION_BIN_NUM
+    equal-width bins between 0 and DISTRIBUTION_MAX, followed by the number of
+    benefits greater than DISTRIBUTION_MAX.
+    '''
+    DISTRIBUTION_BIN_NUM = 10
+    DISTRIBUTION_MAX = 250000
+
+    fund = models.ForeignKey('PensionFund', related_name='benefit_summaries', on_delete=models.CASCADE)
+    count = models.IntegerField()
+    median = models.FloatField()
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    bin_counts = ArrayField(models.IntegerField())
+
+    objects = BenefitSummaryManager()
+
+    class Meta:
+        unique_together = ('fund', 'data_year')
+
+    def __str__(self):
+        return '{} – {}'.format(self.fund, self.data_year)
+
+
+class BenefitSketchQuerySet(models.QuerySet):
+
+    def histogram(self):
+        '''
+        Merge the selected sketches into one histogram.
+        '''
+        return AmountHistogram.merge(sketch.histogram for sketch in self)
+
+
+class BenefitSketchManager(models.Manager.from_queryset(BenefitSketchQuerySet)):
+
+    def refresh(self, data_year, table=None, fund_ids=None):
+        '''
+        Recompute the sketches for the given year, or only the given funds in
+        it, from the Benefit table, or a table with the same columns, in a
+        single pass over the year's benefits.
+        '''
+        table = table or Benefit._meta.db_table
+        fund_filter, fund_sql, fund_params = _fund_filter(fund_ids)
+
+        with transaction.atomic():
+            self.filter(data_year=data_year, **fund_filter).delete()
+
+            with connection.cursor() as cursor:
+                cursor.execute('''
+                    INSERT INTO {sketch_table} (
+                      fund_id, data_year, status, count, total, min_amount, max_amount, buckets, bucket_counts
+                    )
+                    SELECT
+                      fund_id,
+                      data_year,
+                      status,
+                      SUM(count),
+                      SUM(total),
+                      MIN(min_amount),
+                      MAX(max_amount),
+                      array_agg(bucket ORDER BY bucket),
+                      array_agg(count ORDER BY bucket)
+                    FROM (
+                      SELECT
+                        fund_id,
+                        data_year,
+                        UPPER(COALESCE(status, '')) AS status,
+                        CASE
+                          WHEN amount < 1 THEN {zero_bucket}
+                          ELSE floor(ln(amount::float8) / ln(1 + {resolution}))::integer
+                        END AS bucket,
+                        COUNT(*) AS count,
+                        SUM(amount) AS total,
+                        MIN(amount) AS min_amount,
+                        MAX(amount) AS max_amount
+                      FROM {benefit_table}
+                      WHERE data_year = %s
+                      {funds}
+                      GROUP BY 1, 2, 3, 4
+                    ) AS buckets
+                    GROUP BY fund_id, data_year, status
+                '''.format(sketch_table=self.model._meta.db_table,
+                           benefit_table=table,
+                           zero_bucket=ZERO_BUCKET,
+                           resolution=RESOLUTION,
+                           funds=fund_sql), [data_year] + fund_params)
+
+
+class BenefitSketch(VintagedModel):
+    '''
+    Histogram of the benefits with a given status reported by a fund in a
+    given year, for reading percentiles and distributions without scanning
+    the Benefit table. Sketches are refreshed along with benefit summaries.
+    See pensions/sketches.py.
+
+    Statuses are stored in upper case. Benefits without a status, e.g.,
+    before 2018, have an empty status.
+    '''
+    fund = models.ForeignKey('PensionFund', related_name='benefit_sketches', on_delete=models.CASCADE)
+    status = models.CharField(max_length=256, blank=True)
+    count = models.IntegerField()
+    total = models.DecimalField(max_digits=20, decimal_places=2)
+    min_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+    # Sorted indexes of the non-empty buckets, and the number of benefits in
+    # each.
+    buckets = ArrayField(models.IntegerField())
+    bucket_counts = ArrayField(models.IntegerField())
+
+    objects = BenefitSketchManager()
+
+    class Meta:
+        unique_together = ('fund', 'data_year', 'status')
+
+    def __str__(self):
+        return '{} – {} – {}'.format(self.fund, self.data_year, self.status or 'No status')
+
+    @property
+    def histogram(self):
+        return AmountHistogram(
+            dict(zip(self.buckets, self.bucket_counts)),
+            count=self.count,
+            total=float(self.total),
+            minimum=float(self.min_amount),
+            maximum=float(self.max_amount),
+        )
+
+
+# Mirrors Benefit.person_key: the fund, the name as upper case letters and
+# single spaces, the start date and the years of service, as text, joined by
+# the unit separator, with nulls as empty strings.
+PERSON_KEY_SQL = r'''
+    md5(concat_ws(chr(31),
+      fund_id::text,
+      trim(regexp_replace(
+        upper(regexp_replace(first_name || ' ' || last_name, '[^A-Za-z ]', '', 'g')), ' +', ' ', 'g'
+      )),
+      COALESCE(to_char(start_date, 'YYYY-MM-DD'), ''),
+      COALESCE(years_of_service::text, '')
+    ))
+'''
+
+
+class BenefitLinkManager(models.Manager):
+
+    def refresh(self, data_year, table=None, benefit_ids=None):
+        '''
+        Recompute the person keys of the given year's benefits, or only the
+        benefits with the given IDs, read from the Benefit table, or a table
+        with the same columns. Links to given benefits that no longer exist
+        are removed.
+        '''
+        table = table or Benefit._meta.db_table
+
+        links = self.filter(data_year=data_year)
+        benefits = ''
+        params = [data_year]
+
+        if benefit_ids is not None:
+            benefit_ids = list(benefit_ids)
+            links = links.filter(benefit_id__in=benefit_ids)
+            benefits = 'AND id = ANY(%s)'
+            params.append(benefit_ids)
+
+        with transaction.atomic():
+            links.delete()
+
+            with connection.cursor() as cursor:
+                cursor.execute('''
+                    INSERT INTO {link_table} (person_key, fund_id, data_year, benefit_id)
+                    SELECT
+                      {person_key},
+                      fund_id,
+                      data_year,
+                      id
+                    FROM {benefit_table}
+                    WHERE data_year = %s
+                    {benefits}
+                '''.format(link_table=self.model._meta.db_table,
+                           benefit_table=table,
+                           person_key=PERSON_KEY_SQL,
+                           benefits=benefits), params)
+
+
+class BenefitLink(VintagedModel):
+    '''
+    Link from a person key to one of the benefits that share it, so a
+    person's benefits in every year can be found with one index lookup.
+    Links are refreshed along with benefit summaries. See Benefit.person_key.
+
+    Benefit IDs aren't foreign keys, since the Benefit table may be
+    partitioned, and its years swapped out from under the links.
+    '''
+    person_key = models.CharField(max_length=32)
+    fund = models.ForeignKey('PensionFund', related_name='benefit_links', on_delete=models.CASCADE)
+    benefit_id = models.IntegerField()
+
+    objects = BenefitLinkManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['person_key', 'data_year'], name='benefitlink_person_year_idx'),
+            models.Index(fields=['data_year'], name='benefitlink_year_idx'),
+        ]
+
+    def __str__(self):
+        return '{} – {}'.format(self.person_key, self.data_year)
+
+
+class SearchCounter(models.Model):
+    '''
+    Number of searches and page changes an anonymous visitor has made in the
+    benefits table since window_start. See DatabaseLimiter in
+    pensions/throttling.py.
+    '''
+    visitor = models.CharField(max_length=256, primary_key=True)
+    window_start = models.DateTimeField(db_index=True)
+    count = models.IntegerField()
+
+    def __str__(self):
+        return '{} – {}'.format(self.visitor, self.count)
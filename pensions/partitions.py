@@ -0,0 +1,150 @@
+'''
+Helpers for storing Benefit data in a table that is declaratively partitioned
+by data year. Partitioning is optional, and is enabled by running the
+partition_benefits management command against Postgres 11 or newer. Once
+enabled, each data year lives in its own table, e.g., pensions_benefit_2019,
+so a year can be replaced without deleting rows one by one.
+
+Years are replaced by loading them into a standalone staging table, then
+swapping it in once it is complete. The staging table is attached as the
+year's partition, so the swap is nearly instant.
+'''
+import re
+
+from pensions.models import Benefit
+
+
+BENEFIT_TABLE = Benefit._meta.db_table
+
+
+def is_partitioned(cursor):
+    cursor.execute('''
+        SELECT EXISTS (
+          SELECT 1
+          FROM pg_partitioned_table
+          WHERE partrelid = to_regclass(%s)
+        )
+    ''', [BENEFIT_TABLE])
+
+    partitioned, = cursor.fetchone()
+
+    return partitioned
+
+
+def partition_name(data_year):
+    return '{0}_{1}'.format(BENEFIT_TABLE, int(data_year))
+
+
+def create_partition(cursor, data_year):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS {partition}
+        PARTITION OF {table}
+        FOR VALUES IN ({data_year})
+    '''.format(partition=partition_name(data_year),
+               table=BENEFIT_TABLE,
+               data_year=int(data_year)))
+
+
+def staging_name(data_year):
+    return '{0}_staging_{1}'.format(BENEFIT_TABLE, int(data_year))
+
+
+def get_indexes(cursor, table):
+    '''
+    Return the name and definition of each index on the given table, other
+    than its primary key.
+    '''
+    cursor.execute('''
+        SELECT
+          index.relname,
+          pg_get_indexdef(index.oid)
+        FROM pg_index
+        JOIN pg_class AS index
+        ON pg_index.indexrelid = index.oid
+        WHERE pg_index.indrelid = to_regclass(%s)
+        AND NOT pg_index.indisprimary
+    ''', [table])
+
+    return cursor.fetchall()
+
+
+def get_constraints(cursor, table):
+    '''
+    Return the name and definition of each primary key, foreign key, and check
+    constraint on the given table.
+    '''
+    cursor.execute('''
+        SELECT
+          conname,
+          pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = to_regclass(%s)
+        AND contype IN ('p', 'f', 'c')
+    ''', [table])
+
+    return cursor.fetchall()
+
+
+def create_staging_table(cursor, data_year):
+    '''
+    Create an empty staging table for the given year, replacing any left over
+    from an earlier import. Staging tables share the sequence of the Benefit
+    table, so their ids don't collide with live rows.
+    '''
+    table = staging_name(data_year)
+
+    cursor.execute('DROP TABLE IF EXISTS {}'.format(table))
+    cursor.execute('CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS)'.format(table, BENEFIT_TABLE))
+
+
+def index_staging_table(cursor, data_year):
+    '''
+    Build the indexes and constraints of the Benefit table on the loaded
+    staging table for the given year. When it is attached as a partition,
+    Postgres adopts them instead of building its own while holding a lock on
+    the Benefit table.
+    '''
+    table = staging_name(data_year)
+
+    for _, definition in get_indexes(cursor, BENEFIT_TABLE):
+        # Let Postgres name each index, so names never collide with those of
+        # the partition being replaced.
+        definition = re.sub(r'INDEX \S+ ON (ONLY )?\S+', 'INDEX ON {}'.format(table), definition)
+        cursor.execute(definition)
+
+    for name, definition in get_constraints(cursor, BENEFIT_TABLE):
+        if name.endswith('_pkey'):
+            name = '{}_pkey'.format(table)
+
+        cursor.execute('ALTER TABLE {0} ADD CONSTRAINT {1} {2}'.format(table, name, definition))
+
+    # Prove that every row belongs to the year, so attaching the table as a
+    # partition does not need to scan it.
+    cursor.execute('''
+        ALTER TABLE {table} ADD CONSTRAINT {table}_data_year_check CHECK (data_year = {data_year})
+    '''.format(table=table, data_year=int(data_year)))
+
+
+def swap_staging_table(cursor, data_year):
+    '''
+    Replace the partition of the Benefit table for the given year with its
+    indexed staging table. Run this in a transaction, and run it last:
+    dropping the old partition locks the whole Benefit table, until the
+    transaction commits.
+    '''
+    table = staging_name(data_year)
+    partition = partition_name(data_year)
+
+    # Check foreign keys deferred earlier in the transaction, e.g., of new
+    # summaries, now, rather than on commit, while the table is locked.
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    cursor.execute('DROP TABLE IF EXISTS {}'.format(partition))
+    cursor.execute('ALTER TABLE {0} RENAME TO {1}'.format(table, partition))
+    cursor.execute('ALTER TABLE {0} RENAME CONSTRAINT {1}_pkey TO {0}_pkey'.format(partition, table))
+    cursor.execute('''
+        ALTER TABLE {table}
+        ATTACH PARTITION {partition}
+        FOR VALUES IN ({data_year})
+    '''.format(table=BENEFIT_TABLE, partition=partition, data_year=int(data_year)))
+    cursor.execute('ALTER TABLE {0} DROP CONSTRAINT {1}_data_year_check'.format(partition, table))
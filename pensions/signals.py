@@ -0,0 +1,42 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from pensions.cache import bump_generation, bump_year
+from pensions.models import AnnualReport, PensionFund
+
+
+# Generations are bumped once changes are committed, so other requests can't
+# cache the data from before the change under the new generation.
+
+@receiver([post_save, post_delete], sender=PensionFund)
+def invalidate_cache(sender, **kwargs):
+    '''
+    Funds are edited in the admin and loaded from fixtures. Either way, every
+    cached value that mentions them is now stale.
+    '''
+    transaction.on_commit(bump_generation)
+
+
+@receiver([post_save, post_delete], sender=AnnualReport)
+def invalidate_year(sender, instance, **kwargs):
+    '''
+    An annual report only affects cached data for its own year.
+    '''
+    data_year = instance.data_year
+    transaction.on_commit(lambda: bump_year(data_year))
+
+
+@receiver(pre_save, sender=AnnualReport)
+def invalidate_previous_year(sender, instance, raw, **kwargs):
+    '''
+    If an annual report is moved to another year in the admin, the year it
+    was moved from is stale, too.
+    '''
+    if raw or instance.pk is None:
+        return
+
+    previous_year = AnnualReport.objects.filter(pk=instance.pk).values_list('data_year', flat=True).first()
+
+    if previous_year is not None and previous_year != instance.data_year:
+        transaction.on_commit(lambda: bump_year(previous_year))
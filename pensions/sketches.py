@@ -0,0 +1,110 @@
+'''
+Log-linear histograms of benefit amounts, in the spirit of HDR histograms.
+
+Amounts are counted in buckets whose bounds grow by RESOLUTION, so any
+percentile read from a histogram is within RESOLUTION of the true value, no
+matter how amounts are distributed, while a histogram of a whole fund holds no
+more than a thousand or so buckets. Histograms of different funds, years or
+statuses merge by adding their counts.
+
+Bucket i holds amounts from BASE ** i up to BASE ** (i + 1). Amounts less
+than one dollar are counted in bucket ZERO_BUCKET.
+'''
+from bisect import bisect_right
+from collections import Counter
+import math
+
+
+RESOLUTION = 0.01
+BASE = 1 + RESOLUTION
+
+ZERO_BUCKET = -1
+
+
+def bucket_value(bucket):
+    '''
+    Return the amount that stands for the amounts in a bucket: the midpoint
+    of its bounds.
+    '''
+    if bucket == ZERO_BUCKET:
+        return 0
+
+    return (BASE ** bucket + BASE ** (bucket + 1)) / 2
+
+
+class AmountHistogram:
+
+    def __init__(self, buckets=None, count=0, total=0, minimum=None, maximum=None):
+        self.buckets = Counter(buckets or {})
+        self.count = count
+        self.total = total
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @classmethod
+    def merge(cls, histograms):
+        merged = cls()
+
+        for histogram in histograms:
+            merged.buckets.update(histogram.buckets)
+            merged.count += histogram.count
+            merged.total += histogram.total
+
+            if histogram.minimum is not None:
+                merged.minimum = histogram.minimum if merged.minimum is None else min(merged.minimum, histogram.minimum)
+
+            if histogram.maximum is not None:
+                merged.maximum = histogram.maximum if merged.maximum is None else max(merged.maximum, histogram.maximum)
+
+        return merged
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+
+        return self.total / self.count
+
+    def percentile(self, percentile):
+        '''
+        Return the amount below which the given percentage of benefits fall,
+        by the nearest-rank method. The 0th and 100th percentiles are the
+        exact minimum and maximum.
+        '''
+        if not 0 <= percentile <= 100:
+            raise ValueError('Percentiles must be between 0 and 100')
+
+        if not self.count:
+            return None
+
+        if percentile == 0:
+            return self.minimum
+
+        if percentile == 100:
+            return self.maximum
+
+        rank = max(math.ceil(percentile / 100 * self.count), 1)
+        seen = 0
+
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+
+            if seen >= rank:
+                # The bucket's value may fall outside the observed range.
+                return min(max(bucket_value(bucket), self.minimum), self.maximum)
+
+        return self.maximum
+
+    def bin_counts(self, edges):
+        '''
+        Return the number of benefits in each bin between consecutive edges,
+        preceded by the number below the first edge, and followed by the
+        number at or above the last.
+        '''
+        edges = sorted(edges)
+        counts = [0] * (len(edges) + 1)
+
+        for bucket, count in self.buckets.items():
+            counts[bisect_right(edges, bucket_value(bucket))] += count
+
+        return counts
@@ -0,0 +1,507 @@
+import csv
+import datetime
+import importlib
+import io
+import json
+import tempfile
+import threading
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+
+from bga_database import routers
+from pensions.cache import bump_year
+from pensions.models import AnnualReport, Benefit, BenefitLink, BenefitSummary, PensionFund, SearchCounter
+from pensions.throttling import DatabaseLimiter
+from pensions.views import BenefitListJson
+
+
+@override_settings(
+    # Development settings don't cache, so test with an in-process cache.
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    # Render the page without collected, compiled or compressed static files.
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    COMPRESS_ENABLED=False,
+    COMPRESS_OFFLINE=False,
+    COMPRESS_PRECOMPILERS=(),
+    SECURE_SSL_REDIRECT=False,
+)
+class IndexTest(TestCase):
+    fixtures = ['data/fixtures/pension_fund.json']
+
+    @classmethod
+    def setUpTestData(cls):
+        for data_year in (2020, 2021):
+            AnnualReport.objects.bulk_create(
+                AnnualReport(
+                    fund=fund,
+                    data_year=data_year,
+                    eligible_for_social_security=False,
+                    total_liability=2000000000,
+                    assets=1000000000,
+                    employer_contribution=100000000,
+                    employer_normal_cost=50000000,
+                    reporting_period='CALENDAR',
+                )
+                for fund in PensionFund.objects.all()
+            )
+
+            Benefit.objects.bulk_create(
+                Benefit(
+                    fund=fund,
+                    data_year=data_year,
+                    first_name='JANE',
+                    last_name='DOE',
+                    full_name='JANE DOE',
+                    amount=amount,
+                )
+                for fund in PensionFund.objects.all()
+                for amount in (25000, 50000)
+            )
+
+            BenefitSummary.objects.refresh(data_year)
+
+    def test_query_count(self):
+        # With a cold cache, the page loads the years, funds, annual reports
+        # and benefit summaries once each, however many funds and years
+        # there are.
+        with self.assertNumQueries(4):
+            response = self.client.get('/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['data_years'], [2020, 2021])
+
+        # With a warm cache, it runs none.
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+
+        self.assertEqual(response.status_code, 200)
+
+
+class ImportDataTest(TestCase):
+    fixtures = ['data/fixtures/pension_fund.json']
+
+    FIELDS = (
+        'first_name',
+        'last_name',
+        'amount',
+        'years_of_service',
+        'data_year',
+        'fund',
+        'start_date',
+        'final_salary',
+        'status',
+    )
+
+    def benefit(self, first_name, last_name, amount, fund='Chicago Police', **kwargs):
+        row = dict.fromkeys(self.FIELDS, '')
+        row.update(first_name=first_name, last_name=last_name, amount=amount, fund=fund, **kwargs)
+        return row
+
+    def import_data(self, data_year, rows, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+            writer.writeheader()
+            writer.writerows(dict(row, data_year=data_year) for row in rows)
+            f.flush()
+
+            output = io.StringIO()
+            call_command('import_data', f.name, str(data_year), '--warm-cache', 'False', *args, stdout=output)
+
+        return output.getvalue()
+
+    def test_staged_import_without_partitions(self):
+        # Without partitions, staged imports replace each year in place.
+        self.import_data(2020, [self.benefit('JANE', 'DOE', '50000.00')], '--workers', '2')
+        output = self.import_data(2020, [self.benefit('JOHN', 'ROE', '25000.00')], '--workers', '2')
+
+        self.assertIn('importing each year in place', output)
+
+        benefits = Benefit.objects.filter(data_year=2020)
+
+        self.assertEqual([str(benefit) for benefit in benefits], ['JOHN ROE'])
+        self.assertEqual(BenefitSummary.objects.get(data_year=2020).count, 1)
+
+    def test_import_into_partitions(self):
+        call_command('partition_benefits', stdout=io.StringIO())
+
+        # Full imports replace the year's partition with a staging table.
+        self.import_data(2020, [self.benefit('JANE', 'DOE', '50000.00')])
+        output = self.import_data(2020, [self.benefit('JOHN', 'ROE', '25000.00')])
+
+        self.assertIn('swapped in Benefits for 2020', output)
+
+        benefits = Benefit.objects.filter(data_year=2020)
+
+        self.assertEqual([str(benefit) for benefit in benefits], ['JOHN ROE'])
+        self.assertEqual(BenefitSummary.objects.get(data_year=2020).count, 1)
+        self.assertEqual(list(BenefitLink.objects.values_list('benefit_id', flat=True)), [benefits.get().id])
+
+        # Partial imports add to the partition.
+        self.import_data(2020, [self.benefit('JANE', 'DOE', '50000.00')], '--delete', 'False')
+
+        self.assertEqual(BenefitSummary.objects.get(data_year=2020).count, 2)
+
+    def test_diff_import_refreshes_only_changes(self):
+        self.import_data(2020, [
+            self.benefit('JANE', 'DOE', '50000.00'),
+            self.benefit('JOHN', 'ROE', '25000.00'),
+            self.benefit('JOAN', 'POE', '10000.00', fund='Chicago Teachers'),
+        ])
+
+        links = dict(BenefitLink.objects.values_list('benefit_id', 'id'))
+        summaries = dict(BenefitSummary.objects.values_list('fund__name', 'id'))
+        jane, john = Benefit.objects.filter(fund__name='Chicago Police').order_by('first_name')
+
+        self.import_data(2020, [
+            self.benefit('JANE', 'DOE', '50000.00'),
+            self.benefit('JOHN', 'ROE', '26000.00'),
+        ], '--diff')
+
+        new_links = dict(BenefitLink.objects.values_list('benefit_id', 'id'))
+
+        self.assertEqual(new_links[jane.id], links[jane.id])
+        self.assertNotEqual(new_links[john.id], links[john.id])
+        self.assertEqual(len(new_links), 3)
+
+        new_summaries = dict(BenefitSummary.objects.values_list('fund__name', 'id'))
+
+        self.assertEqual(new_summaries['Chicago Teachers'], summaries['Chicago Teachers'])
+        self.assertNotEqual(new_summaries['Chicago Police'], summaries['Chicago Police'])
+        self.assertEqual(BenefitSummary.objects.get(fund__name='Chicago Police').max_amount, 50000)
+
+    def test_diff_import_counts(self):
+        self.import_data(2020, [
+            self.benefit('JANE', 'DOE', '50000.00', start_date='2001-02-03'),
+            self.benefit('JOHN', 'ROE', '25000.00', start_date='1999-12-31'),
+            self.benefit('JOAN', 'POE', '10000.00'),
+        ])
+
+        ids = set(Benefit.objects.values_list('id', flat=True))
+
+        rows = [
+            # Unchanged, though formatted differently.
+            self.benefit('JANE', 'DOE', '50000', start_date='2001-02-03'),
+            # Updated: the same person, with a new amount.
+            self.benefit('JOHN', 'ROE', '26000.00', start_date='1999-12-31'),
+            # Inserted. JOAN POE is deleted.
+            self.benefit('JACK', 'LOE', '5000.00'),
+        ]
+
+        output = self.import_data(2020, rows, '--diff')
+
+        self.assertIn('Chicago Police: 1 inserted, 1 updated, 1 deleted, 1 unchanged', output)
+
+        benefits = Benefit.objects.filter(data_year=2020)
+
+        self.assertEqual(sorted(str(benefit) for benefit in benefits), ['JACK LOE', 'JANE DOE', 'JOHN ROE'])
+        self.assertEqual(len(ids & {benefit.id for benefit in benefits}), 2)
+        self.assertEqual(benefits.get(first_name='JOHN').amount, 26000)
+
+        # Importing the same data again changes nothing.
+        ids = set(benefits.values_list('id', flat=True))
+
+        output = self.import_data(2020, rows, '--diff')
+
+        self.assertIn('Chicago Police: 0 inserted, 0 updated, 0 deleted, 3 unchanged', output)
+        self.assertNotIn('refreshed Benefit summaries', output)
+        self.assertEqual(set(benefits.values_list('id', flat=True)), ids)
+
+    def test_row_hash_matches_sql(self):
+        rows = [
+            self.benefit('JANE', 'DOE', '50000'),
+            self.benefit('JOHN', 'ROE', '1234.5', years_of_service='10.5', final_salary='80000.125'),
+            self.benefit('JOAN', 'POE', '0.01', start_date='2001-02-03', status='Retiree'),
+            self.benefit("MARY-ANN", "O'BRIEN", '10000.00', years_of_service='0', final_salary='0'),
+        ]
+
+        self.import_data(2020, rows)
+
+        hashes = dict(Benefit.objects.values_list('id', 'row_hash'))
+
+        # Rehash the stored rows, as migration 0013 did.
+        migration = importlib.import_module('pensions.migrations.0013_add_benefit_row_hash')
+
+        with connection.cursor() as cursor:
+            cursor.execute(migration.HASH_ROWS)
+
+        self.assertEqual(dict(Benefit.objects.values_list('id', 'row_hash')), hashes)
+
+        # So data loaded either way diff as unchanged.
+        output = self.import_data(2020, rows, '--diff')
+
+        self.assertIn('Chicago Police: 0 inserted, 0 updated, 0 deleted, 4 unchanged', output)
+
+    def test_person_key_matches_sql(self):
+        self.import_data(2020, [
+            self.benefit('JANE', 'DOE', '50000.00'),
+            self.benefit('john', 'roe', '25000.00', years_of_service='10.5', start_date='2001-02-03'),
+            self.benefit("MARY-ANN ", " O'BRIEN  JR.", '10000.00', years_of_service='0'),
+            self.benefit('JOSÉ', 'NÚÑEZ', '5000.00', fund='Chicago Teachers'),
+        ])
+
+        keys = dict(BenefitLink.objects.values_list('benefit_id', 'person_key'))
+
+        self.assertEqual(len(keys), 4)
+
+        for benefit in Benefit.objects.all():
+            key = Benefit.person_key(
+                benefit.fund_id,
+                benefit.first_name,
+                benefit.last_name,
+                benefit.start_date,
+                benefit.years_of_service,
+            )
+
+            self.assertEqual(key, keys[benefit.id], str(benefit))
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    MAILCHIMP_AUTH_COOKIE_NAME='auth',
+    SECURE_SSL_REDIRECT=False,
+)
+class BenefitListJsonTest(TestCase):
+    fixtures = ['data/fixtures/pension_fund.json']
+
+    COLUMNS = ('first_name', 'last_name', 'amount', 'years_of_service', 'final_salary', 'start_date', 'status')
+
+    @classmethod
+    def setUpTestData(cls):
+        fund = PensionFund.objects.get(name='Chicago Police')
+
+        # Ties and nulls in the ordered columns, so pages must break ties on
+        # id, and seek past nulls.
+        for i, (amount, years_of_service) in enumerate([(300, 10), (200, None), (200, 5), (200, 5), (100, None)]):
+            Benefit.objects.create(
+                fund=fund,
+                data_year=2020,
+                first_name='PERSON{}'.format(i),
+                last_name='DOE',
+                full_name='PERSON{} DOE'.format(i),
+                amount=amount,
+                years_of_service=years_of_service,
+            )
+
+    def setUp(self):
+        self.client.cookies['auth'] = 'logged-in'
+
+    def get_page(self, column, direction, **params):
+        query = {
+            'fund': 'Chicago Police',
+            'data_year': 2020,
+            'draw': 1,
+            'order[0][column]': self.COLUMNS.index(column),
+            'order[0][dir]': direction,
+        }
+
+        for i, name in enumerate(self.COLUMNS):
+            query.update({
+                'columns[{}][data]'.format(i): i,
+                'columns[{}][name]'.format(i): '',
+                'columns[{}][searchable]'.format(i): 'true',
+                'columns[{}][orderable]'.format(i): 'true',
+            })
+
+        query.update(params)
+
+        response = self.client.get('/benefits/', query)
+
+        self.assertEqual(response.status_code, 200)
+
+        return json.loads(response.content)
+
+    def page_through(self, column, direction, length):
+        names = []
+        cursor = ''
+
+        while cursor is not None:
+            page = self.get_page(column, direction, length=length, cursor=cursor)
+
+            self.assertLessEqual(len(page['data']), BenefitListJson.max_display_length)
+            self.assertTrue(page['data'])
+
+            names += [row[0] for row in page['data']]
+            cursor = page['next_cursor']
+
+        return names
+
+    def test_cursor_round_trip(self):
+        for column, direction in [('amount', 'desc'), ('amount', 'asc'), ('years_of_service', 'asc'), ('years_of_service', 'desc')]:
+            expected = [row[0] for row in self.get_page(column, direction, start=0, length=10)['data']]
+
+            self.assertEqual(len(expected), 5)
+
+            for length in (1, 2, 5, 10):
+                with self.subTest(column=column, direction=direction, length=length):
+                    self.assertEqual(self.page_through(column, direction, length), expected)
+
+    def test_cursor_length_bounds(self):
+        with mock.patch.object(BenefitListJson, 'max_display_length', 2):
+            # Lengths below one, e.g., -1 for every row, get the longest page.
+            for length in (-1, 0, -5, 3):
+                with self.subTest(length=length):
+                    page = self.get_page('amount', 'desc', length=length, cursor='')
+
+                    self.assertEqual(len(page['data']), 2)
+                    self.assertIsNotNone(page['next_cursor'])
+
+            self.assertEqual(self.page_through('amount', 'desc', -1), self.page_through('amount', 'desc', 2))
+
+    def test_cursor_last_page(self):
+        first = self.get_page('amount', 'desc', length=4, cursor='')
+        last = self.get_page('amount', 'desc', length=4, cursor=first['next_cursor'])
+
+        self.assertEqual([row[0] for row in last['data']], ['PERSON4'])
+        self.assertIsNone(last['next_cursor'])
+
+        # Exactly one page of rows has no next page.
+        page = self.get_page('amount', 'desc', length=5, cursor='')
+
+        self.assertEqual(len(page['data']), 5)
+        self.assertIsNone(page['next_cursor'])
+
+
+class DatabaseLimiterTest(TransactionTestCase):
+
+    def request(self, address='10.0.0.1'):
+        request = RequestFactory().get('/benefits/', REMOTE_ADDR=address)
+        request.session = mock.Mock(session_key=None)
+        return request
+
+    def test_window(self):
+        limiter = DatabaseLimiter(limit=2, timeout=60)
+
+        self.assertEqual([limiter.allow(self.request()) for _ in range(3)], [True, True, False])
+
+        # Other visitors have their own counts.
+        self.assertTrue(limiter.allow(self.request('10.0.0.2')))
+
+        # Once the window has passed, counts start over.
+        SearchCounter.objects.filter(visitor='ip:10.0.0.1').update(
+            window_start=SearchCounter.objects.get(visitor='ip:10.0.0.1').window_start - datetime.timedelta(seconds=61)
+        )
+
+        self.assertEqual([limiter.count(self.request()) for _ in range(2)], [1, 2])
+
+    def test_concurrent_requests(self):
+        limiter = DatabaseLimiter(limit=5, timeout=60)
+
+        counts = []
+        barrier = threading.Barrier(8)
+
+        def count():
+            try:
+                barrier.wait()
+
+                for _ in range(10):
+                    counts.append(limiter.count(self.request()))
+
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=count) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        # Every request is counted exactly once.
+        self.assertEqual(sorted(counts), list(range(1, 81)))
+        self.assertEqual(SearchCounter.objects.get(visitor='ip:10.0.0.1').count, 80)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'pensions.cache_backends.TieredCache',
+        'LOCATION': 'tiered-shared',
+    },
+    'tiered-shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-shared',
+    },
+})
+class TieredCacheTest(TestCase):
+
+    def test_threads_share_local_values(self):
+        caches['default'].set('key', 'value')
+
+        # Only the in-process copy is left.
+        caches['tiered-shared'].clear()
+
+        backends, values = [], []
+
+        def get():
+            backends.append(caches['default'])
+            values.append(caches['default'].get('key'))
+
+        # Each thread gets its own backend, which reads the same values.
+        thread = threading.Thread(target=get)
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(backends[0], caches['default'])
+        self.assertEqual(values, ['value'])
+        self.assertIn('key', caches['default'])
+
+        caches['default'].clear()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ReplicaRouterTest(TransactionTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+        # Configure a replica, without connecting to it. How far it has
+        # replayed is mocked in each test.
+        patchers = [
+            mock.patch.dict(settings.DATABASES, {routers.REPLICA_DB_ALIAS: settings.DATABASES['default']}),
+            mock.patch.object(routers, '_replayed_lsn', 0),
+        ]
+
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def db_for_read(self):
+        with routers.read_from_replica():
+            return routers.ReplicaRouter().db_for_read(Benefit)
+
+    def replay(self, lsn):
+        return mock.patch.object(routers, '_replay_lsn', return_value=lsn)
+
+    def test_reads_wait_for_replay(self):
+        with self.replay('0/0') as replay:
+            self.assertEqual(self.db_for_read(), routers.REPLICA_DB_ALIAS)
+            replay.assert_not_called()
+
+        bump_year(2020)
+        lsn = caches['default'].get(routers.PRIMARY_LSN_KEY)
+
+        with self.replay('0/0'):
+            self.assertIsNone(self.db_for_read())
+
+        with self.replay(lsn):
+            self.assertEqual(self.db_for_read(), routers.REPLICA_DB_ALIAS)
+
+        # Once the replica has caught up, it isn't asked again until the next
+        # bump.
+        with self.replay('0/0') as replay:
+            self.assertEqual(self.db_for_read(), routers.REPLICA_DB_ALIAS)
+            replay.assert_not_called()
+
+    def test_bump_during_request(self):
+        with self.replay('0/0'), routers.read_from_replica():
+            self.assertEqual(routers.ReplicaRouter().db_for_read(Benefit), routers.REPLICA_DB_ALIAS)
+
+            bump_year(2020)
+            routers.check_replica()
+
+            self.assertIsNone(routers.ReplicaRouter().db_for_read(Benefit))
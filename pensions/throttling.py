@@ -0,0 +1,161 @@
+'''
+Limit how many searches and page changes anonymous visitors can make in the
+benefits table before they're asked to log in.
+
+Choose a limiter with the SEARCH_LIMITER setting:
+
+    SEARCH_LIMITER = {
+        'BACKEND': 'pensions.throttling.DatabaseLimiter',
+        'LIMIT': 5,
+        'TIMEOUT': 60 * 60 * 24,
+    }
+
+DatabaseLimiter counts requests in the SearchCounter table, under the
+visitor's session, or IP address, if they don't have a session. Each request
+is counted with one atomic statement, and counts start over TIMEOUT seconds
+after the first request they count.
+
+CacheLimiter counts requests in the cache instead, with the same windows. Use
+it only with caches whose incr is atomic and keeps the key's expiry, e.g.,
+Memcached or Redis. Other caches, e.g., the database cache, get, then set the
+counter, so concurrent requests lose counts, and each request resets the
+counter's expiry.
+
+SessionLimiter counts requests in the session for as long as it lasts, which
+writes to the session store on every counted request.
+'''
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from pensions.models import SearchCounter
+
+
+DEFAULT_LIMITER = {
+    'BACKEND': 'pensions.throttling.DatabaseLimiter',
+    'LIMIT': 5,
+    'TIMEOUT': 60 * 60 * 24,
+}
+
+
+class BaseLimiter:
+
+    def __init__(self, limit, timeout):
+        self.limit = limit
+        self.timeout = timeout
+
+    def allow(self, request):
+        '''
+        Count the request, and return whether it's within the limit.
+        '''
+        return self.count(request) <= self.limit
+
+    def count(self, request):
+        '''
+        Count the request, and return how many requests have been counted for
+        the same visitor, including this one.
+        '''
+        raise NotImplementedError
+
+
+class VisitorMixin:
+
+    def visitor(self, request):
+        session_key = request.session.session_key
+
+        if session_key:
+            return 'session:{}'.format(session_key)
+
+        # Behind a proxy, the address of the visitor is the last one the
+        # proxy added to X-Forwarded-For. Earlier addresses come from the
+        # visitor, and can't be trusted.
+        forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+
+        if forwarded_for:
+            address = forwarded_for.split(',')[-1].strip()
+        else:
+            address = request.META.get('REMOTE_ADDR')
+
+        return 'ip:{}'.format(address)
+
+
+class DatabaseLimiter(VisitorMixin, BaseLimiter):
+
+    # Chance that a request also deletes expired counters.
+    cull_probability = 0.01
+
+    def count(self, request):
+        table = SearchCounter._meta.db_table
+
+        with connection.cursor() as cursor:
+            # Expressions in SET read the counter as it was before the
+            # update, so the window and count start over together.
+            cursor.execute('''
+                INSERT INTO {table} AS counter (visitor, window_start, count)
+                VALUES (%(visitor)s, now(), 1)
+                ON CONFLICT (visitor) DO UPDATE SET
+                  window_start = CASE
+                    WHEN counter.window_start > now() - %(timeout)s * interval '1 second' THEN counter.window_start
+                    ELSE now()
+                  END,
+                  count = CASE
+                    WHEN counter.window_start > now() - %(timeout)s * interval '1 second' THEN counter.count + 1
+                    ELSE 1
+                  END
+                RETURNING count
+            '''.format(table=table), {'visitor': self.visitor(request), 'timeout': self.timeout})
+
+            count, = cursor.fetchone()
+
+            if random.random() < self.cull_probability:
+                cursor.execute('''
+                    DELETE FROM {table}
+                    WHERE window_start <= now() - %s * interval '1 second'
+                '''.format(table=table), [self.timeout])
+
+        return count
+
+
+class CacheLimiter(VisitorMixin, BaseLimiter):
+
+    key_prefix = 'throttle'
+
+    def count(self, request):
+        key = '{0}:{1}'.format(self.key_prefix, self.visitor(request))
+
+        try:
+            return cache.incr(key)
+
+        except ValueError:
+            # This is the visitor's first request, or their counter expired.
+            pass
+
+        if cache.add(key, 1, self.timeout):
+            return 1
+
+        # Another request added the counter first.
+        try:
+            return cache.incr(key)
+
+        except ValueError:
+            return 1
+
+
+class SessionLimiter(BaseLimiter):
+
+    session_key = 'n_searches'
+
+    def count(self, request):
+        request.session[self.session_key] = request.session.get(self.session_key, 0) + 1
+        return request.session[self.session_key]
+
+
+def get_limiter():
+    config = dict(DEFAULT_LIMITER, **getattr(settings, 'SEARCH_LIMITER', {}))
+
+    limiter_class = import_string(config['BACKEND'])
+
+    return limiter_class(config['LIMIT'], config['TIMEOUT'])
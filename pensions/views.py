@@ -1,63 +1,206 @@
+import base64
+from collections import Counter, OrderedDict
+import functools
+import hashlib
 import json
+import re
+import time
 
 from django.contrib.humanize.templatetags.humanize import intword, intcomma
 from django.conf import settings
 from django.core.cache import cache
-from django.core.exceptions import PermissionDenied
-from django.db import connection
-from django.db.models import Q, FloatField, Count
-from django.http import HttpResponse, HttpResponseRedirect
-from django.views.generic import TemplateView
+from django.core.exceptions import PermissionDenied, SuspiciousOperation
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import OperationalError, connections, router, transaction
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.utils.text import slugify
+from django.views.generic import TemplateView, View
 
 from django_datatables_view.base_datatable_view import BaseDatatableView
-from postgres_stats.aggregates import Percentile
+from psycopg2.extensions import QueryCanceledError
 
-from pensions.models import PensionFund, Benefit
+from bga_database.routers import check_replica, read_from_replica
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from pensions import metrics
+from pensions.cache import INDEX_SCOPE, bump_generation, fund_scope, get_generations, year_scope
+from pensions.exports import ExportFile, copy_csv, gzip_chunks
+from pensions.models import PensionFund, AnnualReport, Benefit, BenefitLink, BenefitSketch, BenefitSummary
+from pensions.sketches import AmountHistogram
+from pensions.throttling import get_limiter
 
 
 # One week
 CACHE_TIMEOUT = 60*60*24*7
 
+# How long one worker may hold the lock to compute a cached value, and how
+# often other workers check whether it has finished.
+CACHE_LOCK_TIMEOUT = 60
+CACHE_LOCK_POLL_INTERVAL = 0.1
+
+
+def cached(key):
+    '''
+    Decorator that turns a CacheMixin method into a property, whose value is
+    computed at most once per request and stored in the cache under key, in
+    the view's cache_scopes.
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self):
+            return self.get_or_compute(key, lambda: method(self))
+
+        return property(wrapper)
+
+    return decorator
+
 
 class CacheMixin:
+    '''
+    Load the values for cache_keys in one round trip when the view is created.
+    Values are stored under the current generations of the scopes they depend
+    on, so they are never read again once the data behind them change, while
+    values in other scopes stay cached. Keys in cache_keys depend on
+    cache_scopes. Other values name their scopes when they are loaded.
+
+    Values missing from the cache are computed once across all workers: the
+    first worker to miss a key takes a lock and computes it, while others wait
+    for the value to appear, rather than all querying the database at once.
+    '''
     cache_keys = []
+    cache_scopes = ()
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._cache = cache.get_many(self.cache_keys)
-        self.initial_keys = list(self._cache.keys())
+        self._generations = {}
+        self._cache = {}
+        self.prefetch((key, self.cache_scopes) for key in self.cache_keys)
+
+    def prefetch(self, keys):
+        '''
+        Load the values for an iterable of (key, scopes) pairs, fetching the
+        generations of scopes that haven't been seen yet in one round trip,
+        then the values in another.
+        '''
+        keys = [(key, tuple(scopes)) for key, scopes in keys]
+
+        scopes = {scope for _, key_scopes in keys for scope in key_scopes}
+        self._generations.update(get_generations(scopes - set(self._generations)))
+
+        # The generations may have been bumped since the request started.
+        check_replica()
+
+        versioned_keys = {self._versioned_key(key, scopes): key for key, scopes in keys}
+
+        for versioned_key, value in cache.get_many(list(versioned_keys)).items():
+            self._cache[versioned_keys[versioned_key]] = value
+            metrics.record_cache(versioned_keys[versioned_key], hit=True)
+
+    def get_or_compute(self, key, compute, scopes=None):
+        if key not in self._cache:
+            metrics.record_cache(key, hit=False)
+
+            if scopes is None:
+                scopes = self.cache_scopes
+
+            self._cache[key] = self._compute_once(self._versioned_key(key, scopes), compute)
+
+        return self._cache[key]
+
+    def warm_cache(self):
+        '''
+        Compute and store every value in cache_keys that is missing from the
+        cache.
+        '''
+        for key in self.cache_keys:
+            getattr(self, key)
+
+    def _versioned_key(self, key, scopes):
+        if not set(scopes) <= set(self._generations):
+            self._generations.update(get_generations(set(scopes) - set(self._generations)))
+
+        generations = [self._generations[scope] for scope in (None,) + tuple(scopes)]
+
+        return '{0}:{1}'.format(key, '.'.join(str(generation) for generation in generations))
+
+    def _compute_once(self, key, compute):
+        lock_key = 'lock:{}'.format(key)
+
+        deadline = time.monotonic() + CACHE_LOCK_TIMEOUT
+
+        while not cache.add(lock_key, True, CACHE_LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                # The worker holding the lock is stuck. Don't wait forever.
+                return compute()
+
+            time.sleep(CACHE_LOCK_POLL_INTERVAL)
+
+            value = cache.get(key)
+
+            if value is not None:
+                return value
+
+        try:
+            value = cache.get(key)
+
+            if value is None:
+                value = compute()
+                cache.set(key, value, CACHE_TIMEOUT)
+
+        finally:
+            cache.delete(lock_key)
+
+        return value
 
-    def _update_cache(self):
-        new_keys = {k: v for k, v in self._cache.items() if k not in self.initial_keys}
-        if new_keys:
-            cache.set_many(new_keys, CACHE_TIMEOUT)
 
-    def render_to_response(self, *args, **kwargs):
-        self._update_cache()
-        return super().render_to_response(*args, **kwargs)
+class ReplicaMixin:
+    '''
+    Read from the replica database, if there is one, while handling the
+    request. See bga_database/routers.py.
+    '''
+    def dispatch(self, *args, **kwargs):
+        with read_from_replica():
+            return super().dispatch(*args, **kwargs)
 
 
-class Index(CacheMixin, TemplateView):
+class Index(ReplicaMixin, CacheMixin, TemplateView):
     template_name = 'index.html'
+
+    # Values that depend on every year. Chart data are cached separately for
+    # each year, and each fund in each year, so importing a year or editing
+    # an annual report leaves the other years cached.
     cache_keys = [
         'data_years',
-        'benefit_aggregates',
-        'binned_benefit_data',
-        'funding_aggregates',
+        'default_year',
+        'funds',
     ]
+    cache_scopes = (INDEX_SCOPE,)
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
 
+        # Everything the page needs from the database is cached, so a request
+        # with a warm cache runs no queries and serializes no data. The page
+        # itself is not cached, because it varies by request, e.g., with
+        # messages and the CSRF token in the login forms.
         context['data_years'] = list(self.data_years)
         context['default_year'] = self.default_year
-        context['pension_funds'] = self.pension_funds
-        context['data_by_year'] = json.dumps(self.data_by_year())
+        context['pension_funds'] = [name for _, name in self.funds]
+        context['data_by_year'] = self.data_by_year
         context['search_link'] = '#search'
         context['title'] = 'Home'
 
         return context
 
+    def warm_cache(self):
+        super().warm_cache()
+        self.data_by_year
+
     def _format_large_number(self, number):
         word = intword(number)
         try:
@@ -67,231 +210,191 @@ class Index(CacheMixin, TemplateView):
         else:
             return intcomma(number)
 
+    @property
     def data_by_year(self):
-        data_by_year = {}
+        '''
+        Chart data for each year, serialized for the page's JavaScript. Each
+        piece is cached as JSON, and joined without parsing it again.
+        '''
+        self.prefetch(
+            [('funding:{}'.format(year), (year_scope(year),)) for year in self.data_years] +
+            [('fund:{0}:{1}'.format(fund_id, year), (year_scope(year), fund_scope(fund_id, year)))
+             for year in self.data_years for fund_id, _ in self.funds]
+        )
 
-        data_by_fund = self.fund_metadata
-        funding_aggregates = self.funding_aggregates
+        data_by_year = []
 
         for year in self.data_years:
-            year_data = {
-                'aggregate_funding': funding_aggregates[year],
-                'data_by_fund': data_by_fund[year],
-            }
+            aggregate_funding = self.get_or_compute(
+                'funding:{}'.format(year),
+                lambda: json.dumps(self._funding_aggregates(year)),
+                (year_scope(year),)
+            )
+
+            data_by_fund = []
+
+            for fund_id, fund_name in self.funds:
+                fund_data = self.get_or_compute(
+                    'fund:{0}:{1}'.format(fund_id, year),
+                    lambda: json.dumps(self._fund_metadata(fund_id, year)),
+                    (year_scope(year), fund_scope(fund_id, year))
+                )
 
-            data_by_year[year] = year_data
+                data_by_fund.append('{0}: {1}'.format(json.dumps(fund_name), fund_data))
 
-        return data_by_year
+            year_data = '{{"aggregate_funding": {0}, "data_by_fund": {{{1}}}}}'.format(
+                aggregate_funding,
+                ', '.join(data_by_fund)
+            )
 
-    @property
+            data_by_year.append('{0}: {1}'.format(json.dumps(str(year)), year_data))
+
+        return '{{{}}}'.format(', '.join(data_by_year))
+
+    @cached('default_year')
     def default_year(self):
         '''
         Show the most recent year where there is an annual report for all funds.
         '''
-        with connection.cursor() as cursor:
-            cursor.execute('''
-                SELECT MAX(data_year)
-                FROM (
-                  SELECT
-                    data_year,
-                    COUNT(*) AS fund_count
-                  FROM pensions_annualreport AS report
-                  GROUP BY data_year
-                ) x
-                WHERE fund_count = (
-                  SELECT COUNT(*)
-                  FROM pensions_pensionfund
-                )
-            ''')
-
-            result, = cursor
-            default_year, = result
-
-            return default_year
+        fund_count = len(self.pension_funds)
 
-    @property
-    def data_years(self):
-        data = self._cache.get('data_years', None)
+        reports_per_year = Counter(report.data_year for report in self.annual_reports)
 
-        if data is None:
-            with connection.cursor() as cursor:
-                cursor.execute('SELECT DISTINCT(data_year) FROM pensions_benefit')
-                data = sorted([year[0] for year in cursor])
+        complete_years = [year for year, count in reports_per_year.items() if count == fund_count]
 
-            # This is referenced a bunch of times. Update the local cache, so
-            # this query is only run once.
-            self._cache['data_years'] = data
+        return max(complete_years, default=None)
 
-        return data
+    @cached('data_years')
+    def data_years(self):
+        return list(BenefitSummary.objects.order_by('data_year')
+                                          .values_list('data_year', flat=True)
+                                          .distinct())
 
     @property
     def pension_funds(self):
         if not hasattr(self, '_pension_funds'):
-            self._pension_funds = PensionFund.objects.all().order_by('name')
+            self._pension_funds = list(PensionFund.objects.all().order_by('name'))
         return self._pension_funds
 
     @property
-    def benefit_aggregates(self):
-        data = self._cache.get('benefit_aggregates', None)
-
-        if data is None:
-            aggregates = Benefit.objects\
-                                .values('fund__name', 'data_year')\
-                                .annotate(median=Percentile('amount', 0.5, output_field=FloatField()), count=Count('id'))
-
-            data = {year: {} for year in self.data_years}
-
-            for year in data.keys():
-                agg = [a for a in aggregates if a['data_year'] == year]
-                for a in agg:
-                    data[year][a['fund__name']] = {
-                        'median': self._format_large_number(a['median']),
-                        'count': self._format_large_number(a['count']),
-                    }
-
-            self._cache['benefit_aggregates'] = data
+    def annual_reports(self):
+        '''
+        Every annual report, loaded in one query and shared by the properties
+        that need them.
+        '''
+        if not hasattr(self, '_annual_reports'):
+            self._annual_reports = list(AnnualReport.objects.select_related('fund'))
+        return self._annual_reports
 
-        return data
+    @cached('funds')
+    def funds(self):
+        return [(fund.id, fund.name) for fund in self.pension_funds]
 
     @property
-    def binned_benefit_data(self):
-        data = self._cache.get('binned_benefit_data', None)
-
-        if data is None:
-            DISTRIBUTION_BIN_NUM = 10
-            DISTRIBUTION_MAX = 250000
-
-            bin_size = DISTRIBUTION_MAX / DISTRIBUTION_BIN_NUM
+    def benefit_summaries(self):
+        '''
+        Benefit statistics for each fund and year, as computed at import time.
+        '''
+        if not hasattr(self, '_benefit_summaries'):
+            self._benefit_summaries = {
+                (summary.fund_id, summary.data_year): summary
+                for summary in BenefitSummary.objects.all()
+            }
+        return self._benefit_summaries
 
-            with connection.cursor() as cursor:
-                cursor.execute('''
-                    SELECT
-                      data_year,
-                      fund.name AS fund_name,
-                      width_bucket(amount, 0, 250000, 10) AS bucket_index,
-                      MAX(amount) AS max_value,
-                      COUNT(*)
-                    FROM pensions_benefit AS benefit
-                    JOIN pensions_pensionfund AS fund
-                    ON benefit.fund_id = fund.id
-                    GROUP BY data_year, fund.name, bucket_index
-                    ORDER BY data_year, fund.name, bucket_index
-                ''')
+    def _binned_benefit_data(self, summary):
+        DISTRIBUTION_BIN_NUM = BenefitSummary.DISTRIBUTION_BIN_NUM
+        DISTRIBUTION_MAX = BenefitSummary.DISTRIBUTION_MAX
 
-                binned_data = {}
+        bin_size = DISTRIBUTION_MAX / DISTRIBUTION_BIN_NUM
 
-                for row in cursor:
-                    data_year, fund, bucket_index, max_value, value = row
-                    binned_data[(data_year, fund, bucket_index)] = (value, max_value)
+        if summary:
+            bin_counts, max_value = summary.bin_counts, summary.max_amount
+        else:
+            bin_counts, max_value = [0] * (DISTRIBUTION_BIN_NUM + 1), 0
 
-            data = {year: {} for year in self.data_years}
+        fund_data = []
 
-            for year in data.keys():
-                year_data = {}
+        for i, value in enumerate(bin_counts):
+            lower = int(i * bin_size)
+            upper = int(lower + bin_size)
 
-                for fund in self.pension_funds:
-                    fund_data = []
+            if i == DISTRIBUTION_BIN_NUM and max_value > upper:
+                upper = max_value
 
-                    for i in range(DISTRIBUTION_BIN_NUM + 1):
-                        value, max_value = binned_data.get((year, fund.name, i + 1), (0, 0))
+            fund_data.append({
+                'y': int(value),  # number of benefits in given bin
+                'lower_edge': self._format_large_number(lower),
+                'upper_edge': self._format_large_number(upper),
+            })
 
-                        lower = int(i * bin_size)
-                        upper = int(lower + bin_size)
+        return fund_data
 
-                        if i == DISTRIBUTION_BIN_NUM and max_value > upper:
-                            upper = max_value
+    def _funding_aggregates(self, data_year):
+        '''
+        [list, of, level, data] for the given year
+        '''
+        data = []
 
-                        fund_data.append({
-                            'y': int(value),  # number of benefits in given bin
-                            'lower_edge': self._format_large_number(lower),
-                            'upper_edge': self._format_large_number(upper),
-                        })
+        totals = OrderedDict()
 
-                    year_data[fund.name] = fund_data
+        for annual_report in self.annual_reports:
+            if annual_report.data_year != data_year:
+                continue
 
-                data[year] = year_data
+            key = annual_report.fund.fund_type
 
-            self._cache['binned_benefit_data'] = data
+            funded_liability, unfunded_liability, member_funds = totals.get(key, (0, 0, []))
 
-        return data
+            totals[key] = (
+                funded_liability + annual_report.assets,
+                unfunded_liability + annual_report.total_liability - annual_report.assets,
+                member_funds + [annual_report.fund.name],
+            )
 
-    @property
-    def funding_aggregates(self):
-        '''
-        {2017: [list, of, level, data]}
-        '''
-        data = self._cache.get('funding_aggregates', None)
+        for fund_type, (funded_liability, unfunded_liability, member_funds) in totals.items():
+            container_name = '{}-container'.format(fund_type.lower())
+            funded_liability = float(funded_liability)
+            unfunded_liability = float(unfunded_liability)
 
-        if data is None:
-            data = {year: [] for year in self.data_years}
+            chart_data = self._make_pie_chart(container_name, funded_liability, unfunded_liability)
 
-            with connection.cursor() as cursor:
-                cursor.execute('''
-                    SELECT
-                      data_year,
-                      fund_type,
-                      SUM(assets) AS funded_liability,
-                      SUM(total_liability - assets) AS unfunded_liability,
-                      ARRAY_AGG(fund.name) AS member_funds
-                    FROM pensions_pensionfund AS fund
-                    JOIN pensions_annualreport AS report
-                    ON fund.id = report.fund_id
-                    WHERE data_year IN %s
-                    GROUP BY data_year, fund_type
-                ''', [tuple(data.keys())])
+            chart_data['fund_type'] = fund_type.lower()
+            chart_data['member_funds'] = '; '.join([fund for fund in sorted(member_funds)])
 
-                annual_reports = cursor.fetchall()
+            data.append(chart_data)
 
-            for data_year, fund_type, funded_liability, unfunded_liability, member_funds in annual_reports:
-                container_name = '{}-container'.format(fund_type.lower())
-                funded_liability = float(funded_liability)
-                unfunded_liability = float(unfunded_liability)
+        return data
 
-                chart_data = self._make_pie_chart(container_name, funded_liability, unfunded_liability)
+    def _fund_metadata(self, fund_id, data_year):
+        fund_data = {}
 
-                chart_data['fund_type'] = fund_type.lower()
-                chart_data['member_funds'] = '; '.join([fund for fund in sorted(member_funds)])
+        for annual_report in self.annual_reports:
+            if annual_report.fund_id != fund_id or annual_report.data_year != data_year:
+                continue
 
-                data[data_year].append(chart_data)
+            funded_liability = float(annual_report.assets)
+            unfunded_liability = float(annual_report.unfunded_liability)
+            normal_cost = float(annual_report.employer_normal_cost)
+            amortization_cost = float(annual_report.amortization_cost)
 
-            self._cache['funding_aggregates'] = data
+            fund_data = {
+                'aggregate_funding': self._make_pie_chart('fund-container', funded_liability, unfunded_liability),
+                'amortization_cost': self._make_bar_chart('amortization-cost', normal_cost, amortization_cost),
+                'total_liability': self._format_large_number(int(annual_report.total_liability)),
+                'employer_contribution': self._format_large_number(int(annual_report.employer_contribution)),
+                'funding_level': int(annual_report.funded_ratio * 100),
+            }
 
-        return data
+        summary = self.benefit_summaries.get((fund_id, data_year))
 
-    @property
-    def fund_metadata(self):
-        data = {year: {} for year in self.data_years}
-
-        binned_benefit_data = self.binned_benefit_data
-        median_benefits = self.benefit_aggregates
-
-        for fund in self.pension_funds.prefetch_related('annual_reports'):
-            for annual_report in fund.annual_reports.filter(data_year__in=data.keys()):
-                funded_liability = float(annual_report.assets)
-                unfunded_liability = float(annual_report.unfunded_liability)
-                normal_cost = float(annual_report.employer_normal_cost)
-                amortization_cost = float(annual_report.amortization_cost)
-
-                data[annual_report.data_year][fund.name] = {
-                    'aggregate_funding': self._make_pie_chart('fund-container', funded_liability, unfunded_liability),
-                    'amortization_cost': self._make_bar_chart('amortization-cost', normal_cost, amortization_cost),
-                    'total_liability': self._format_large_number(int(annual_report.total_liability)),
-                    'employer_contribution': self._format_large_number(int(annual_report.employer_contribution)),
-                    'funding_level': int(annual_report.funded_ratio * 100),
-                }
-
-            for year in data.keys():
-                fund_data = data[year].get(fund.name, {})
-
-                fund_data.update({
-                    'binned_benefit_data': binned_benefit_data[year][fund.name],
-                    'median_benefit': median_benefits[year].get(fund.name, {}).get('median', 0),
-                    'total_benefits': median_benefits[year].get(fund.name, {}).get('count', 0),
-                })
-
-                data[year][fund.name] = fund_data
+        fund_data.update({
+            'binned_benefit_data': self._binned_benefit_data(summary),
+            'median_benefit': self._format_large_number(summary.median) if summary else 0,
+            'total_benefits': self._format_large_number(summary.count) if summary else 0,
+        })
 
-        return data
+        return fund_data
 
     def _make_pie_chart(self, container, funded_liability, unfunded_liability):
         return {
@@ -335,6 +438,42 @@ class Index(CacheMixin, TemplateView):
         }
 
 
+class FundSummaryJson(Index):
+    '''
+    Chart data for one fund in one year, as the home page embeds them for
+    every fund and year, for clients that need only one. Shares the home
+    page's cached pieces, which are stored as JSON, so a request with a warm
+    cache serializes nothing.
+    '''
+    cache_keys = [
+        'funds',
+        'data_years',
+    ]
+
+    def get(self, request, *args, **kwargs):
+        fund_ids = {name: fund_id for fund_id, name in self.funds}
+
+        try:
+            fund_id = fund_ids[request.GET['fund']]
+            data_year = int(request.GET['data_year'])
+
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Choose a fund and a data year.'}, status=400)
+
+        # Don't cache a summary for every year a client asks for.
+        if data_year not in self.data_years:
+            return JsonResponse({'error': 'No benefits found'}, status=404)
+
+        key = 'fund:{0}:{1}'.format(fund_id, data_year)
+        scopes = (year_scope(data_year), fund_scope(fund_id, data_year))
+
+        self.prefetch([(key, scopes)])
+
+        fund_data = self.get_or_compute(key, lambda: json.dumps(self._fund_metadata(fund_id, data_year)), scopes)
+
+        return HttpResponse(fund_data, content_type='application/json')
+
+
 class UserGuide(TemplateView):
     template_name = 'user-guide.html'
 
@@ -345,9 +484,21 @@ class UserGuide(TemplateView):
         return context
 
 
-class BenefitListJson(BaseDatatableView):
+class BenefitListJson(ReplicaMixin, CacheMixin, BaseDatatableView):
+    '''
+    Pages of benefits for the DataTables on the home page. Each page is cached
+    under a key normalized from the request, in the generations of the fund
+    and year it shows, so repeated requests for the same page don't query
+    benefits until that fund's data change.
+    '''
     model = Benefit
 
+    # Fund IDs depend only on the global generation, which is bumped when a
+    # fund changes.
+    cache_keys = [
+        'fund_ids',
+    ]
+
     # define the columns that will be returned
     columns = [
         'first_name',
@@ -363,73 +514,320 @@ class BenefitListJson(BaseDatatableView):
     # requests
     max_display_length = 500
 
+    # max number of search results counted for pagination; searches matching
+    # more benefits than this page through the first filtered_count_limit
+    filtered_count_limit = 10000
+
+    # request parameter that switches to keyset pagination
+    cursor_param = 'cursor'
+
+    # max time the queries for one page may run, in milliseconds; protects
+    # workers from slow searches
+    statement_timeout = 10000
+
+    # version of the rows in each page; bump it when they change, so pages
+    # cached in the old format aren't served
+    row_format = 2
+
+    timeout_message = 'This page took too long to load. Try a more specific search.'
+
     def dispatch(self, *args, **kwargs):
         try:
             return super().dispatch(*args, **kwargs)
         except PermissionDenied as e:
             return self.get_json_response(str(e), status=401)
+        except OperationalError as e:
+            if not isinstance(e.__cause__, QueryCanceledError):
+                raise
+
+            # DataTables shows the error, and keeps the table as it was.
+            return self.get_json_response(self.dumps({
+                'draw': int(self.request.GET.get('draw', 0)),
+                'error': self.timeout_message,
+                'result': 'error',
+            }))
 
     def get(self, *args, **kwargs):
         '''
         Kick unauthenticated users to the login screen after five keyword
         searches and/or result page changes.
         '''
-        if self.request.GET.get('search[value]', False) or int(self.request.GET.get('start'), 0) > 0:
-            if not self.request.session.get('n_searches'):
-                self.request.session['n_searches'] = 0
-
-            self.request.session['n_searches'] += 1
+        page_change = int(self.request.GET.get('start', 0)) > 0 or self.request.GET.get('cursor')
 
-            anonymous_user = settings.MAILCHIMP_AUTH_COOKIE_NAME not in self.request.COOKIES
+        anonymous_user = settings.MAILCHIMP_AUTH_COOKIE_NAME not in self.request.COOKIES
 
-            if anonymous_user and self.request.session['n_searches'] > 5:
+        if anonymous_user and (self.request.GET.get('search[value]', False) or page_change):
+            if not get_limiter().allow(self.request):
                 raise PermissionDenied
 
-        return super().get(*args, **kwargs)
+        response = self.get_context_data(**kwargs)
+
+        if 'error' in response or 'sError' in response:
+            response['result'] = 'error'
+        else:
+            response['result'] = 'ok'
+
+        return self.render_to_response(self.dumps(response))
+
+    def dumps(self, response):
+        '''
+        Rows are formatted as strings and numbers before they're cached, so
+        they can be serialized without a custom encoder, and with orjson,
+        if it's installed.
+        '''
+        if orjson is not None:
+            return orjson.dumps(response)
+
+        return json.dumps(response)
+
+    @property
+    def fund_id(self):
+        '''
+        Resolve the requested fund up front, so the benefit query filters on a
+        constant fund_id and can use the (fund_id, data_year, ...) indexes.
+        '''
+        return self.fund_ids.get(self.request.GET['fund'])
+
+    @cached('fund_ids')
+    def fund_ids(self):
+        return dict(PensionFund.objects.values_list('name', 'id'))
+
+    @property
+    def data_year(self):
+        return int(self.request.GET['data_year'])
+
+    @property
+    def search(self):
+        '''
+        Searches are case insensitive and ignore surrounding whitespace, so
+        normalize them before filtering or building cache keys.
+        '''
+        search = self.request.GET.get('search[value]', '').strip().upper()
+        return search or None
+
+    def get_total_records(self):
+        '''
+        Read the number of benefits for the requested fund and year from the
+        summaries stored at import time, rather than counting them.
+        '''
+        total_records = BenefitSummary.objects.filter(fund_id=self.fund_id, data_year=self.data_year)\
+                                              .values_list('count', flat=True)\
+                                              .first()
+
+        # Funds without benefits in a given year have no summary.
+        return total_records or 0
+
+    def get_total_display_records(self, qs, total_records):
+        '''
+        Unfiltered views show every benefit for the fund and year. Otherwise,
+        count matching benefits up to filtered_count_limit.
+        '''
+        if not self.search:
+            return total_records
+
+        return qs[:self.filtered_count_limit].count()
 
     def filter_queryset(self, qs):
-        qs = qs.filter(fund__name=self.request.GET['fund'],
-                       data_year=int(self.request.GET['data_year']))
+        if self.fund_id is None:
+            return qs.none()
 
-        search = self.request.GET.get('search[value]', None)
+        return qs.filter(fund_id=self.fund_id, data_year=self.data_year).search(self.search)
 
-        if search:
-            first_name = Q(first_name__istartswith=search)
-            last_name = Q(last_name__istartswith=search)
-            full_name = Q(full_name__istartswith=search)
-            qs = qs.filter((first_name | last_name) | full_name)
+    @property
+    def keyset_paging(self):
+        '''
+        Page with a cursor, rather than an offset, when the request includes a
+        cursor parameter. Pass an empty cursor to request the first page, then
+        the next_cursor value from each response to request the next one.
+        '''
+        return self.cursor_param in self._querydict
+
+    @property
+    def keyset_length(self):
+        '''
+        Rows per page with a cursor, up to max_display_length. Pages can't
+        be empty, since the next cursor comes from the last row, so lengths
+        below one, e.g., DataTables' -1 for every row, get the longest page.
+        '''
+        length = int(self._querydict.get('length', 10))
 
-        return qs
+        if length < 1:
+            return self.max_display_length
 
-    def prepare_results(self, qs):
-        json_data = []
-
-        for item in qs:
-            json_data.append([
-                item.first_name,
-                item.last_name,
-                self._format_currency(item.amount),
-                self._format_years_of_service(item.years_of_service),
-                self._format_currency(item.final_salary),
-                item.start_date,
-                item.status,
-            ])
+        return min(length, self.max_display_length)
 
-        return json_data
+    def ordering(self, qs):
+        '''
+        Break ties on id, so that pages are stable and each row has a unique
+        position for keyset pagination to seek past.
+        '''
+        qs = super().ordering(qs)
+
+        order = list(qs.query.order_by)
+
+        if order:
+            tiebreaker = '-id' if order[-1].startswith('-') else 'id'
+        else:
+            tiebreaker = 'id'
+
+        self._order = order + [tiebreaker]
+
+        return qs.order_by(*self._order)
+
+    @property
+    def row_fields(self):
+        '''
+        Columns fetched for each row: the displayed columns, plus the ordering
+        columns that keyset pagination needs to encode a cursor.
+        '''
+        order_fields = [key.lstrip('-') for key in self._order]
+        return self.columns + [field for field in order_fields if field not in self.columns]
+
+    def paging(self, qs):
+        # Fetch tuples of the fields in each row, rather than model instances.
+        qs = qs.values_list(*self.row_fields)
+
+        if not self.keyset_paging:
+            return super().paging(qs)
+
+        limit = self.keyset_length
+
+        cursor = self._querydict.get(self.cursor_param)
+
+        if cursor:
+            qs = self._seek(qs, self._decode_cursor(cursor))
+
+        # Fetch one extra row to find out whether there is a next page.
+        rows = list(qs[:limit + 1])
+
+        if len(rows) > limit:
+            rows = rows[:limit]
+            self.next_cursor = self._encode_cursor(rows[-1])
+        else:
+            self.next_cursor = None
+
+        return rows
+
+    def _seek(self, qs, values):
+        '''
+        Filter the queryset to rows that sort after the given values of the
+        ordering columns, i.e., (a, b, id) > (x, y, z) for ascending columns,
+        accounting for descending columns and Postgres's default placement
+        of nulls: last in ascending order, first in descending order.
+        '''
+        if len(values) != len(self._order):
+            raise SuspiciousOperation('Cursor does not match the requested ordering')
+
+        conditions = []
+        preceding_equal = Q()
+
+        for key, value in zip(self._order, values):
+            descending = key.startswith('-')
+            field = key.lstrip('-')
+
+            after = self._after(field, value, descending)
+
+            if after is not None:
+                conditions.append(preceding_equal & after)
+
+            if value is None:
+                preceding_equal &= Q(**{'{}__isnull'.format(field): True})
+            else:
+                preceding_equal &= Q(**{field: value})
+
+        if not conditions:
+            return qs.none()
+
+        seek = conditions.pop(0)
+
+        for condition in conditions:
+            seek |= condition
+
+        # The seek condition is an OR, which Postgres can't use to bound an
+        # index scan. Add the equivalent range on the leading column.
+        leading_field = self._order[0].lstrip('-')
+
+        if values[0] is not None and not Benefit._meta.get_field(leading_field).null:
+            lookup = 'lte' if self._order[0].startswith('-') else 'gte'
+            qs = qs.filter(**{'{0}__{1}'.format(leading_field, lookup): values[0]})
+
+        return qs.filter(seek)
+
+    def _after(self, field, value, descending):
+        nullable = Benefit._meta.get_field(field).null
+
+        if value is None:
+            # Nulls come last in ascending order, and first in descending order.
+            return Q(**{'{}__isnull'.format(field): False}) if descending else None
+
+        if descending:
+            return Q(**{'{}__lt'.format(field): value})
+
+        after = Q(**{'{}__gt'.format(field): value})
+
+        if nullable:
+            after |= Q(**{'{}__isnull'.format(field): True})
+
+        return after
+
+    def _encode_cursor(self, row):
+        fields = dict(zip(self.row_fields, row))
+        values = [fields[key.lstrip('-')] for key in self._order]
+        cursor = json.dumps(values, cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+
+    def _decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except ValueError:
+            values = None
+
+        if not isinstance(values, list):
+            raise SuspiciousOperation('Invalid cursor')
+
+        return values
+
+    def prepare_results(self, qs):
+        '''
+        Format rows of displayed columns, as fetched by paging, in one pass.
+        '''
+        format_currency = self._format_currency
+        format_years_of_service = self._format_years_of_service
+        person_key = Benefit.person_key
+        fund_id = self.fund_id
+
+        # Rows end with the benefit's person key, which DataTables ignores,
+        # for requesting the person's history from BenefitHistoryJson.
+        return [
+            [
+                first_name,
+                last_name,
+                format_currency(amount),
+                format_years_of_service(years_of_service),
+                format_currency(final_salary),
+                start_date.isoformat() if start_date else None,
+                status,
+                person_key(fund_id, first_name, last_name, start_date, years_of_service),
+            ]
+            for first_name, last_name, amount, years_of_service, final_salary, start_date, status, *_ in qs
+        ]
 
     def _format_currency(self, amount):
-        if amount in ('', None, 'None'):
+        # Equivalent to intcomma for two-place decimals, without the regular
+        # expressions.
+        if amount is None:
             return amount
-        return '${}'.format(intcomma(amount))
+        return '${:,}'.format(amount)
 
     def _format_years_of_service(self, years):
-        if years:
-            return round(years)
-        return years
+        if years is None:
+            return years
+        return round(years)
 
     def get_context_data(self, *args, **kwargs):
         '''
-        Override this in order to access the cached total records value.
+        Override this in order to serve pages from the cache, read total
+        records from benefit summaries and bound the filtered count.
         '''
         try:
             self.initialize(*args, **kwargs)
@@ -454,46 +852,467 @@ class BenefitListJson(BaseDatatableView):
             # prepare list of columns to be returned
             self._columns = self.get_columns()
 
-            # prepare initial queryset
-            qs = self.get_initial_queryset()
+            key, scopes = self._page_key(), self._page_scopes()
 
-            # store the total number of records (before filtering)
-            # TODO: Cache this, rather than hardcoding
-            total_records = 3713872
+            self.prefetch([(key, scopes)])
 
-            # apply filters
-            qs = self.filter_queryset(qs)
+            page = self.get_or_compute(key, self._get_page, scopes)
 
-            # number of records after filtering
-            total_display_records = qs.count()
-
-            # apply ordering
-            qs = self.ordering(qs)
-
-            # apply pagintion
-            qs = self.paging(qs)
-
-            # prepare output data
+            # Cached pages are shared, so copy them into a new response with
+            # the draw counter, which differs for every request.
             if self.pre_camel_case_notation:
-                aaData = self.prepare_results(qs)
-
-                ret = {'sEcho': int(self._querydict.get('sEcho', 0)),
-                       'iTotalRecords': total_records,
-                       'iTotalDisplayRecords': total_display_records,
-                       'aaData': aaData
-                       }
+                ret = {'sEcho': int(self._querydict.get('sEcho', 0))}
             else:
-                data = self.prepare_results(qs)
+                ret = {'draw': int(self._querydict.get('draw', 0))}
+
+            ret.update(page)
 
-                ret = {'draw': int(self._querydict.get('draw', 0)),
-                       'recordsTotal': total_records,
-                       'recordsFiltered': total_display_records,
-                       'data': data
-                       }
             return ret
         except Exception as e:
             return self.handle_exception(e)
 
+    def _page_key(self):
+        '''
+        Key a page on everything that determines its contents: fund, year,
+        normalized search, resolved ordering and position, but not the draw
+        counter.
+        '''
+        # Resolve the ordering from the request, the same way the page query
+        # does, so that equivalent requests share a key.
+        self.ordering(self.model.objects.none())
+
+        if self.pre_camel_case_notation:
+            start = self._querydict.get('iDisplayStart', 0)
+            length = self._querydict.get('iDisplayLength', 10)
+        else:
+            start = self._querydict.get('start', 0)
+            length = self._querydict.get('length', 10)
+
+        if self.keyset_paging:
+            length = self.keyset_length
+            position = ['cursor', self._querydict.get(self.cursor_param)]
+        else:
+            length = min(int(length), self.max_display_length)
+            position = ['start', int(start)]
+
+        page = [
+            self.fund_id,
+            self.data_year,
+            self.search,
+            self._order,
+            length,
+            position,
+            self.pre_camel_case_notation,
+        ]
+
+        # Searches and cursors are arbitrary text, so hash them into a key
+        # that every cache backend accepts.
+        digest = hashlib.md5(json.dumps(page).encode('utf-8')).hexdigest()
+
+        return 'benefit_page:{0}:{1}'.format(self.row_format, digest)
+
+    def _page_scopes(self):
+        if self.fund_id is None:
+            return (year_scope(self.data_year),)
+
+        return (year_scope(self.data_year), fund_scope(self.fund_id, self.data_year))
+
+    def _get_page(self):
+        '''
+        Query the page in a transaction, with a statement timeout that lasts
+        until the end of it.
+        '''
+        using = router.db_for_read(self.model)
+
+        with transaction.atomic(using=using):
+            with connections[using].cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = %s', [self.statement_timeout])
+
+            return self._query_page()
+
+    def _query_page(self):
+        # prepare initial queryset
+        qs = self.get_initial_queryset()
+
+        # store the total number of records (before filtering)
+        total_records = self.get_total_records()
+
+        # apply filters
+        qs = self.filter_queryset(qs)
+
+        # number of records after filtering
+        total_display_records = self.get_total_display_records(qs, total_records)
+
+        # apply ordering
+        qs = self.ordering(qs)
+
+        # apply pagintion
+        qs = self.paging(qs)
+
+        # prepare output data
+        if self.pre_camel_case_notation:
+            ret = {'iTotalRecords': total_records,
+                   'iTotalDisplayRecords': total_display_records,
+                   'aaData': self.prepare_results(qs)
+                   }
+        else:
+            ret = {'recordsTotal': total_records,
+                   'recordsFiltered': total_display_records,
+                   'data': self.prepare_results(qs)
+                   }
+
+        if self.keyset_paging:
+            ret['next_cursor'] = self.next_cursor
+
+        return ret
+
+
+class BenefitStatsJson(ReplicaMixin, CacheMixin, View):
+    '''
+    Statistics of benefit amounts for any funds, years and status, read from
+    the sketches stored at import time: count, total, mean, minimum, maximum,
+    arbitrary percentiles, and counts in bins with arbitrary edges. Results
+    are grouped by fund and year, by fund, by year, or not at all.
+
+    Percentiles and bin counts are within 1% of the exact amounts. See
+    pensions/sketches.py.
+    '''
+    default_percentiles = (10, 25, 50, 75, 90)
+
+    groupings = {
+        'fund_year': lambda fund, year: (fund, year),
+        'fund': lambda fund, year: (fund, None),
+        'year': lambda fund, year: (None, year),
+        'all': lambda fund, year: (None, None),
+    }
+
+    def get(self, request, *args, **kwargs):
+        self.prefetch([('fund_ids', ()), ('data_years', (INDEX_SCOPE,))])
+
+        try:
+            funds, years = self._selected_funds(), self._selected_years()
+            status = request.GET.get('status')
+            percentiles = self._numbers('percentiles', self.default_percentiles)
+            edges = sorted(self._numbers('bins', ()))
+            group = self.groupings[request.GET.get('group_by', 'fund_year')]
+
+            for percentile in percentiles:
+                if not 0 <= percentile <= 100:
+                    raise ValueError('Percentiles must be between 0 and 100')
+
+        except KeyError:
+            return JsonResponse({'error': 'group_by must be one of {}'.format(', '.join(self.groupings))}, status=400)
+
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        # Load the sketches for every selected fund and year in one round trip
+        # to the cache, then any that are missing in one query.
+        self.prefetch(
+            (self._sketch_key(fund_id, year), (year_scope(year), fund_scope(fund_id, year)))
+            for _, fund_id in funds for year in years
+        )
+
+        self._load_missing_sketches(funds, years)
+
+        histograms = OrderedDict()
+
+        for fund_name, fund_id in funds:
+            for year in years:
+                sketches = self._sketches(fund_id, year)
+
+                if status is not None:
+                    sketches = [sketches[status.upper()]] if status.upper() in sketches else []
+                else:
+                    sketches = list(sketches.values())
+
+                histograms.setdefault(group(fund_name, year), []).extend(sketches)
+
+        results = []
+
+        for (fund_name, year), sketches in histograms.items():
+            histogram = AmountHistogram.merge(sketches)
+
+            result = OrderedDict()
+
+            if fund_name is not None:
+                result['fund'] = fund_name
+
+            if year is not None:
+                result['data_year'] = year
+
+            result.update({
+                'count': histogram.count,
+                'total': self._round(histogram.total),
+                'mean': self._round(histogram.mean),
+                'min': self._round(histogram.minimum),
+                'max': self._round(histogram.maximum),
+                'percentiles': OrderedDict(
+                    ('{:g}'.format(percentile), self._round(histogram.percentile(percentile)))
+                    for percentile in percentiles
+                ),
+            })
+
+            if edges:
+                result['bin_counts'] = histogram.bin_counts(edges)
+
+            results.append(result)
+
+        return JsonResponse({
+            'status': status,
+            'bins': edges,
+            'results': results,
+        })
+
+    def _selected_funds(self):
+        fund_ids = self.get_or_compute('fund_ids', lambda: dict(PensionFund.objects.values_list('name', 'id')), ())
+
+        names = self.request.GET.getlist('fund') or sorted(fund_ids)
+
+        unknown = [name for name in names if name not in fund_ids]
+
+        if unknown:
+            raise ValueError('Unknown funds: {}'.format(', '.join(unknown)))
+
+        return [(name, fund_ids[name]) for name in names]
+
+    def _selected_years(self):
+        data_years = self.get_or_compute(
+            'data_years',
+            lambda: list(BenefitSummary.objects.order_by('data_year').values_list('data_year', flat=True).distinct()),
+            (INDEX_SCOPE,)
+        )
+
+        try:
+            years = [int(year) for year in self.request.GET.getlist('data_year')]
+
+        except ValueError:
+            raise ValueError('data_year must be a year')
+
+        unknown = [str(year) for year in years if year not in data_years]
+
+        if unknown:
+            raise ValueError('No benefits for data years: {}'.format(', '.join(unknown)))
+
+        return years or data_years
+
+    def _load_missing_sketches(self, funds, years):
+        '''
+        Load the sketches missing from the cache in one query, and store them
+        in one round trip. Computing them is as cheap as waiting for a lock,
+        so they are stored without one.
+        '''
+        missing = {
+            (fund_id, year): (year_scope(year), fund_scope(fund_id, year))
+            for _, fund_id in funds for year in years
+            if self._sketch_key(fund_id, year) not in self._cache
+        }
+
+        if not missing:
+            return
+
+        sketches = {key: {} for key in missing}
+
+        for sketch in BenefitSketch.objects.filter(
+            fund_id__in={fund_id for fund_id, _ in missing},
+            data_year__in={year for _, year in missing}
+        ):
+            if (sketch.fund_id, sketch.data_year) in sketches:
+                sketches[(sketch.fund_id, sketch.data_year)][sketch.status] = sketch.histogram
+
+        values = {}
+
+        for (fund_id, year), scopes in missing.items():
+            key = self._sketch_key(fund_id, year)
+            metrics.record_cache(key, hit=False)
+
+            self._cache[key] = sketches[(fund_id, year)]
+            values[self._versioned_key(key, scopes)] = self._cache[key]
+
+        cache.set_many(values, CACHE_TIMEOUT)
+
+    def _sketches(self, fund_id, year):
+        '''
+        Histograms of the fund's benefits in a year, by status.
+        '''
+        return self._cache[self._sketch_key(fund_id, year)]
+
+    def _sketch_key(self, fund_id, year):
+        return 'sketches:{0}:{1}'.format(fund_id, year)
+
+    def _numbers(self, param, default):
+        value = self.request.GET.get(param)
+
+        if not value:
+            return default
+
+        try:
+            return [float(number) for number in value.split(',')]
+
+        except ValueError:
+            raise ValueError('{} must be a comma-separated list of numbers'.format(param))
+
+    def _round(self, value):
+        return round(value, 2) if value is not None else None
+
+
+class BenefitHistoryJson(ReplicaMixin, CacheMixin, View):
+    '''
+    Every benefit that shares a person key, i.e., a person's benefit in each
+    year, found with one index lookup, rather than a search of each year.
+    Rows of the benefits table end with their person key. See
+    Benefit.person_key.
+    '''
+    def get(self, request, *args, **kwargs):
+        person_key = request.GET.get('person', '')
+
+        if not re.fullmatch('[0-9a-f]{32}', person_key):
+            return JsonResponse({'error': 'person must be a person key from the benefits table'}, status=400)
+
+        # Histories show as much as a search of every year, so anonymous
+        # visitors are limited as they are in the benefits table.
+        anonymous_user = settings.MAILCHIMP_AUTH_COOKIE_NAME not in request.COOKIES
+
+        if anonymous_user and not get_limiter().allow(request):
+            return JsonResponse({'error': 'Log in to see benefit histories.'}, status=401)
+
+        # Links are refreshed along with any year or fund, which bumps the
+        # index scope.
+        key = 'benefit_history:{}'.format(person_key)
+
+        self.prefetch([(key, (INDEX_SCOPE,))])
+
+        benefits = self.get_or_compute(key, lambda: self._history(person_key), (INDEX_SCOPE,))
+
+        if not benefits:
+            return JsonResponse({'error': 'No benefits found'}, status=404)
+
+        return JsonResponse({
+            'person': person_key,
+            'benefits': benefits,
+        })
+
+    def _history(self, person_key):
+        benefits = Benefit.objects.filter(
+            id__in=BenefitLink.objects.filter(person_key=person_key).values('benefit_id')
+        ).order_by(
+            'data_year', '-amount'
+        ).values_list(
+            'data_year',
+            'fund__name',
+            'first_name',
+            'last_name',
+            'amount',
+            'years_of_service',
+            'final_salary',
+            'start_date',
+            'status',
+        )
+
+        return [
+            OrderedDict([
+                ('data_year', data_year),
+                ('fund', fund),
+                ('first_name', first_name),
+                ('last_name', last_name),
+                ('amount', self._number(amount)),
+                ('years_of_service', self._number(years_of_service)),
+                ('final_salary', self._number(final_salary)),
+                ('start_date', start_date.isoformat() if start_date else None),
+                ('status', status),
+            ])
+            for data_year, fund, first_name, last_name, amount, years_of_service, final_salary, start_date, status
+            in benefits
+        ]
+
+    def _number(self, value):
+        return float(value) if value is not None else None
+
+
+class BenefitExport(ReplicaMixin, CacheMixin, View):
+    '''
+    Download a fund's benefits in one year as CSV, optionally only those
+    whose name starts with a search, and optionally gzipped. Logged in users
+    only.
+
+    Rows are streamed from Postgres with COPY as they're read, and whole
+    years are also kept on disk, so exports use constant memory, and one
+    request replaces paging through the benefits table. See
+    pensions/exports.py.
+    '''
+    login_message = 'Log in to download benefit data.'
+
+    def head(self, request, *args, **kwargs):
+        '''
+        Let the page check whether the visitor may download, before sending
+        them to the export.
+        '''
+        if not self._authenticated():
+            return JsonResponse({'error': self.login_message}, status=401)
+
+        return HttpResponse()
+
+    def get(self, request, *args, **kwargs):
+        if not self._authenticated():
+            return JsonResponse({'error': self.login_message}, status=401)
+
+        self.prefetch([('fund_ids', ())])
+
+        fund_ids = self.get_or_compute('fund_ids', lambda: dict(PensionFund.objects.values_list('name', 'id')), ())
+
+        try:
+            fund = request.GET['fund']
+            fund_id = fund_ids[fund]
+            data_year = int(request.GET['data_year'])
+
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Choose a fund and a data year to export.'}, status=400)
+
+        # Don't write empty exports to disk for years the fund has no data.
+        if not BenefitSummary.objects.filter(fund_id=fund_id, data_year=data_year).exists():
+            return JsonResponse({'error': 'No benefits found'}, status=404)
+
+        search = request.GET.get('search', '').strip().upper()
+        gzipped = request.GET.get('gzip', '').lower() in ('1', 'true')
+
+        # Resolve the database now, since the response is streamed after the
+        # view returns.
+        using = router.db_for_read(Benefit)
+
+        benefits = Benefit.objects.filter(fund_id=fund_id, data_year=data_year).search(search).order_by('-amount', '-id')
+
+        if search:
+            content = copy_csv(benefits, using)
+
+            if gzipped:
+                content = gzip_chunks(content)
+
+        else:
+            export = ExportFile(fund_id, data_year)
+
+            try:
+                content = export.open(gzipped)
+
+            except FileNotFoundError:
+                content = export.write(copy_csv(benefits, using), gzipped)
+
+        filename = '_'.join(part for part in (slugify(fund), str(data_year), slugify(search)) if part)
+
+        if gzipped:
+            response = StreamingHttpResponse(content, content_type='application/gzip')
+            filename += '.csv.gz'
+
+        else:
+            response = StreamingHttpResponse(content, content_type='text/csv')
+            filename += '.csv'
+
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+
+        return response
+
+    def _authenticated(self):
+        return settings.MAILCHIMP_AUTH_COOKIE_NAME in self.request.COOKIES or self.request.user.is_authenticated
+
 
 def pong(request):
     try:
@@ -504,8 +1323,21 @@ def pong(request):
     return HttpResponse(DEPLOYMENT_ID)
 
 
+def metrics_view(request):
+    '''
+    Metrics of the worker that serves the request, for local monitoring, or
+    anyone with the cache key.
+    '''
+    local = request.META.get('REMOTE_ADDR') in ('127.0.0.1', '::1') and 'HTTP_X_FORWARDED_FOR' not in request.META
+
+    if not (local or request.GET.get('key', '') == settings.CACHE_KEY):
+        raise Http404
+
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4')
+
+
 def flush_cache(request):
     if request.GET.get('key', '') == settings.CACHE_KEY:
-        cache.clear()
+        bump_generation()
 
     return HttpResponseRedirect(request.build_absolute_uri('/'))